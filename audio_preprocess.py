@@ -0,0 +1,182 @@
+# app/agents/audio_preprocess.py
+"""
+Prétraitement audio avant STT:
+ 1) décodage unique en 16 kHz mono float32 (format natif de Whisper)
+ 2) réduction des silences (énergie RMS par trame, ou webrtcvad si installé)
+ 3) table de correspondance des temps pour ramener les segments sur l'audio original
+
+Le WAV PCM est décodé et rééchantillonné en NumPy; les formats compressés du navigateur
+(webm/ogg/mp4) passent par ffmpeg, qui fait alors le rééchantillonnage pendant le décodage.
+"""
+import os
+import shutil
+import subprocess
+import wave
+from bisect import bisect_right
+from typing import Dict, Any, List, Tuple
+import numpy as np
+
+try:
+    import webrtcvad
+    WEBRTCVAD_AVAILABLE = True
+except Exception:
+    WEBRTCVAD_AVAILABLE = False
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+SILENCE_DB = float(os.getenv("STT_SILENCE_DB", "-45"))          # plancher absolu (dBFS)
+SILENCE_MARGIN_DB = float(os.getenv("STT_SILENCE_MARGIN_DB", "10"))  # au-dessus du bruit de fond estimé
+MIN_SILENCE_S = float(os.getenv("STT_MIN_SILENCE_S", "0.6"))    # silences plus courts conservés tels quels
+KEEP_SILENCE_S = float(os.getenv("STT_KEEP_SILENCE_S", "0.3"))  # durée conservée d'un long silence
+SPEECH_PAD_S = float(os.getenv("STT_SPEECH_PAD_S", "0.2"))      # marge autour de la parole détectée
+VAD_MODE = os.getenv("STT_VAD", "energy")                        # energy | webrtc
+
+# (début traité, début original, durée) en secondes
+TimeMap = List[Tuple[float, float, float]]
+
+def _pcm_to_float(raw: bytes, sample_width: int) -> np.ndarray:
+    if sample_width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if sample_width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    if sample_width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16))
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 8388608.0
+    if sample_width == 4:
+        return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    raise ValueError(f"Largeur d'échantillon non supportée: {sample_width}")
+
+def downmix(samples: np.ndarray, channels: int) -> np.ndarray:
+    if channels == 1:
+        return samples
+    return samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+def _lowpass(x: np.ndarray, cutoff: float, numtaps: int = 63) -> np.ndarray:
+    # sinc fenêtré (Hamming); cutoff normalisé sur la fréquence d'échantillonnage d'entrée
+    n = np.arange(numtaps) - (numtaps - 1) / 2.0
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(numtaps)
+    taps /= taps.sum()
+    return np.convolve(x, taps.astype(np.float32), mode="same").astype(np.float32)
+
+def resample(x: np.ndarray, sr_in: int, sr_out: int = SAMPLE_RATE) -> np.ndarray:
+    if sr_in == sr_out or x.size == 0:
+        return x.astype(np.float32, copy=False)
+    if sr_in > sr_out:
+        # anti-repliement avant décimation
+        x = _lowpass(x, 0.5 * sr_out / sr_in)
+        if sr_in % sr_out == 0:
+            return np.ascontiguousarray(x[:: sr_in // sr_out])
+    n_out = int(round(x.size * sr_out / float(sr_in)))
+    t_out = np.arange(n_out, dtype=np.float64) * (sr_in / float(sr_out))
+    return np.interp(t_out, np.arange(x.size, dtype=np.float64), x).astype(np.float32)
+
+def decode_audio(file_path: str) -> np.ndarray:
+    """Décode une seule fois en 16 kHz mono float32."""
+    try:
+        with wave.open(file_path, "rb") as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            raw = w.readframes(w.getnframes())
+        return resample(downmix(_pcm_to_float(raw, width), channels), rate, SAMPLE_RATE)
+    except (wave.Error, EOFError):
+        pass
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg requis pour décoder ce format audio")
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", file_path, "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"]
+    out = subprocess.run(cmd, capture_output=True, check=True)
+    return np.frombuffer(out.stdout, dtype="<f4").copy()
+
+def _energy_speech_mask(frames: np.ndarray) -> np.ndarray:
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+    db = 20 * np.log10(rms)
+    threshold = max(SILENCE_DB, float(np.percentile(db, 10)) + SILENCE_MARGIN_DB)
+    return db > threshold
+
+def _webrtc_speech_mask(frames: np.ndarray) -> np.ndarray:
+    vad = webrtcvad.Vad(int(os.getenv("STT_VAD_AGGRESSIVENESS", "2")))
+    pcm = (np.clip(frames, -1.0, 1.0) * 32767).astype("<i2")
+    return np.array([vad.is_speech(f.tobytes(), SAMPLE_RATE) for f in pcm], dtype=bool)
+
+def speech_mask(audio: np.ndarray, frame_len: int) -> np.ndarray:
+    n_frames = audio.size // frame_len
+    frames = audio[: n_frames * frame_len].reshape(n_frames, frame_len)
+    if VAD_MODE == "webrtc" and WEBRTCVAD_AVAILABLE:
+        mask = _webrtc_speech_mask(frames)
+    else:
+        mask = _energy_speech_mask(frames)
+    pad = int(round(SPEECH_PAD_S * 1000 / FRAME_MS))
+    if pad and mask.any():
+        mask = np.convolve(mask.astype(np.int32), np.ones(2 * pad + 1, dtype=np.int32), mode="same") > 0
+    return mask
+
+def compress_silence(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> Tuple[np.ndarray, TimeMap]:
+    """Raccourcit les silences > MIN_SILENCE_S à KEEP_SILENCE_S. Retourne (audio, time_map)."""
+    frame_len = sample_rate * FRAME_MS // 1000
+    n_frames = audio.size // frame_len
+    if n_frames == 0:
+        return audio, [(0.0, 0.0, audio.size / float(sample_rate))]
+    keep = speech_mask(audio, frame_len)
+    min_sil = int(round(MIN_SILENCE_S * 1000 / FRAME_MS))
+    keep_sil = int(round(KEEP_SILENCE_S * 1000 / FRAME_MS))
+    # bornes des plages de silence: transitions du masque
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], keep.astype(np.int8), [1]))))
+    for start, end in zip(edges[0::2], edges[1::2]):
+        if end - start > min_sil:
+            keep[start:end] = False
+            keep[start:start + keep_sil] = True
+        else:
+            keep[start:end] = True
+    # la queue (< une trame) suit la dernière trame
+    sample_keep = np.repeat(keep, frame_len)
+    tail = audio.size - sample_keep.size
+    if tail:
+        sample_keep = np.concatenate((sample_keep, np.full(tail, keep[-1])))
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], sample_keep.astype(np.int8), [0]))))
+    time_map: TimeMap = []
+    processed = 0
+    for start, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+        time_map.append((processed / float(sample_rate), start / float(sample_rate), (end - start) / float(sample_rate)))
+        processed += end - start
+    return audio[sample_keep], time_map
+
+def to_original_time(t: float, time_map: TimeMap, starts: List[float] = None) -> float:
+    if t is None or not time_map:
+        return t
+    if starts is None:
+        starts = [m[0] for m in time_map]
+    i = max(0, bisect_right(starts, t) - 1)
+    proc_start, orig_start, duration = time_map[i]
+    return orig_start + min(max(t - proc_start, 0.0), duration)
+
+def remap_segments(segments: List[Dict[str, Any]], time_map: TimeMap) -> List[Dict[str, Any]]:
+    """Ramène start/end (et words[].start/end de whisperx) sur la ligne de temps originale."""
+    starts = [m[0] for m in time_map]
+
+    def remap(t):
+        return to_original_time(t, time_map, starts)
+
+    out = []
+    for seg in segments:
+        seg = dict(seg)
+        seg["start"] = remap(seg.get("start"))
+        seg["end"] = remap(seg.get("end"))
+        if seg.get("words"):
+            seg["words"] = [dict(w, start=remap(w.get("start")), end=remap(w.get("end"))) for w in seg["words"]]
+        out.append(seg)
+    return out
+
+def preprocess_file(file_path: str, trim_silence: bool = True) -> Dict[str, Any]:
+    audio = decode_audio(file_path)
+    original_duration = audio.size / float(SAMPLE_RATE)
+    if trim_silence:
+        audio, time_map = compress_silence(audio)
+    else:
+        time_map = [(0.0, 0.0, original_duration)]
+    return {
+        "audio": audio,
+        "sample_rate": SAMPLE_RATE,
+        "time_map": time_map,
+        "original_duration": original_duration,
+        "processed_duration": audio.size / float(SAMPLE_RATE),
+    }
@@ -0,0 +1,72 @@
+# tools/bench_billing_ranker.py
+"""
+Latence du classement BM25 selon la taille du catalogue (catalogues synthétiques).
+    python tools/bench_billing_ranker.py --sizes 1000 10000 50000 --notes 200
+"""
+import argparse, json, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.agents.billing_ranker import BillingRanker
+
+_SYLLABLES = ["chla", "my", "dia", "go", "nor", "rhee", "sy", "phi", "lis", "her", "pes", "vi", "ral", "ure", "thri", "te", "pro", "cto", "cer", "vi"]
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def synthetic_catalog(size: int, rng: random.Random):
+    entries = []
+    for i in range(size):
+        label = " ".join(_word(rng) for _ in range(rng.randint(1, 4)))
+        entries.append({
+            "key": f"k{i}",
+            "label": {"fr": label, "en": label},
+            "icd10ca": f"Z{i:05d}",
+            "ccp": f"CCP-{i:05d}",
+            "keywords": {"fr": [_word(rng) for _ in range(rng.randint(1, 4))], "en": [_word(rng) for _ in range(rng.randint(0, 2))]},
+        })
+    return entries
+
+def synthetic_note(rng: random.Random, words: int = 250) -> str:
+    return " ".join(_word(rng) for _ in range(words))
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def bench(size: int, n_notes: int, top_k: int, seed: int = 0):
+    rng = random.Random(seed)
+    entries = synthetic_catalog(size, rng)
+    notes = [synthetic_note(rng) for _ in range(n_notes)]
+    t0 = time.perf_counter()
+    ranker = BillingRanker(entries)
+    build_s = time.perf_counter() - t0
+    single = []
+    for note in notes:
+        t = time.perf_counter()
+        ranker.rank(note, top_k=top_k)
+        single.append((time.perf_counter() - t) * 1000)
+    t = time.perf_counter()
+    ranker.rank_batch(notes, top_k=top_k)
+    batch_s = time.perf_counter() - t
+    return {
+        "catalog_size": size,
+        "vocab": len(ranker.terms),
+        "build_s": round(build_s, 3),
+        "single_p50_ms": round(_pct(single, 0.5), 3),
+        "single_p95_ms": round(_pct(single, 0.95), 3),
+        "batch_notes_per_s": round(n_notes / batch_s, 1) if batch_s > 0 else None,
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark du classement des codes de facturation")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args(argv)
+    for size in args.sizes:
+        print(json.dumps(bench(size, args.notes, args.top_k)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# tools/bench_stt.py
+"""
+Compare les moteurs STT locaux sur des enregistrements français de référence:
+facteur temps réel (RTF = temps de calcul / durée audio, < 1 = plus rapide que le temps réel) et taux d'erreur mots (WER).
+Chaque fichier audio est accompagné de sa transcription de référence (même nom, extension .txt).
+    python tools/bench_stt.py samples/fr --backends faster-whisper whisper --threads 4
+    WHISPER_COMPUTE_TYPE=int8 WHISPER_BEAM_SIZE=1 python tools/bench_stt.py samples/fr --backends faster-whisper
+"""
+import argparse, json, os, re, sys, time, unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_APOSTROPHES = str.maketrans({"’": "'", "‘": "'", "`": "'"})
+_PUNCT = re.compile(r"[^\w'\s-]|(?<!\w)[-']|[-'](?!\w)")
+
+def normalize_words(text: str):
+    """Minuscules, apostrophes unifiées, ponctuation retirée; les accents sont conservés (erreurs réelles en français)."""
+    text = unicodedata.normalize("NFC", text).translate(_APOSTROPHES).lower()
+    text = _PUNCT.sub(" ", text)
+    words = []
+    for word in text.split():
+        # élisions: « l'examen » -> « l' examen », comptées comme deux mots des deux côtés
+        parts = re.split(r"(?<=')", word)
+        words.extend(p for p in parts if p)
+    return words
+
+def edit_distance(ref, hyp) -> int:
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1]
+
+def collect_pairs(inputs):
+    from app.agents.stt_batch import collect_files
+    pairs = []
+    for path in collect_files(inputs):
+        ref = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(ref):
+            with open(ref, "r", encoding="utf-8") as f:
+                pairs.append((path, f.read()))
+    return pairs
+
+def bench_backend(engine: str, pairs, language: str):
+    from app.agents import stt_whisper
+    from app.agents.stt_batch import probe_duration
+    t0 = time.perf_counter()
+    warm = stt_whisper.warm_model(engine)
+    load_s = time.perf_counter() - t0
+    audio_s = proc_s = 0.0
+    edits = ref_words = 0
+    per_file = []
+    for path, reference in pairs:
+        duration = probe_duration(path)
+        t = time.perf_counter()
+        result = stt_whisper._run_whisper_in_thread(path, language, engine=engine)
+        elapsed = time.perf_counter() - t
+        ref, hyp = normalize_words(reference), normalize_words(result["text"])
+        errors = edit_distance(ref, hyp)
+        audio_s += duration
+        proc_s += elapsed
+        edits += errors
+        ref_words += len(ref)
+        per_file.append({"file": os.path.basename(path), "rtf": round(elapsed / duration, 3) if duration else None,
+                         "wer": round(errors / len(ref), 4) if ref else None})
+    return {
+        "backend": engine,
+        "model": warm.get("model"),
+        "compute_type": stt_whisper.WHISPER_COMPUTE_TYPE if engine == "faster-whisper" else None,
+        "beam_size": stt_whisper.WHISPER_BEAM_SIZE if engine == "faster-whisper" else None,
+        "files": len(pairs),
+        "load_s": round(load_s, 2),
+        "audio_s": round(audio_s, 1),
+        "proc_s": round(proc_s, 1),
+        "rtf": round(proc_s / audio_s, 3) if audio_s else None,
+        # WER du corpus: erreurs totales / mots de référence totaux (pas la moyenne des WER par fichier)
+        "wer": round(edits / ref_words, 4) if ref_words else None,
+        "per_file": per_file,
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark RTF / WER des moteurs STT locaux")
+    parser.add_argument("inputs", nargs="+", help="fichiers audio ou dossiers (référence: même nom en .txt)")
+    parser.add_argument("--backends", nargs="+", default=["faster-whisper", "whisper", "whisperx"])
+    parser.add_argument("--language", default="fr")
+    parser.add_argument("--threads", type=int, default=0, help="fils intra-op (WHISPER_CPU_THREADS / torch)")
+    parser.add_argument("--no-preprocess", action="store_true", help="désactiver décodage 16 kHz + compression des silences")
+    parser.add_argument("--per-file", action="store_true")
+    args = parser.parse_args(argv)
+    if args.threads:
+        os.environ["WHISPER_CPU_THREADS"] = str(args.threads)
+        os.environ["OMP_NUM_THREADS"] = str(args.threads)
+    from app.agents import stt_whisper
+    if args.threads:
+        try:
+            import torch
+            torch.set_num_threads(args.threads)
+        except Exception:
+            pass
+    if args.no_preprocess:
+        stt_whisper.STT_PREPROCESS = False
+    available = {"faster-whisper": stt_whisper.FASTER_WHISPER_AVAILABLE, "whisperx": stt_whisper.WHISPERX_AVAILABLE, "whisper": stt_whisper.WHISPER_AVAILABLE}
+    pairs = collect_pairs(args.inputs)
+    if not pairs:
+        print("aucun couple audio / .txt de référence trouvé", file=sys.stderr)
+        return 1
+    for engine in args.backends:
+        if not available.get(engine):
+            print(json.dumps({"backend": engine, "skipped": "not installed"}))
+            continue
+        report = bench_backend(engine, pairs, args.language)
+        if not args.per_file:
+            report.pop("per_file")
+        print(json.dumps(report, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,26 @@
 # app/agents/billing_agent.py
 from typing import Dict, Any, List, Optional
-import os, json, uuid, requests
+import os, json, uuid, asyncio, logging, threading, requests
 from .base import AgentBase
+from .billing_catalog import CompiledCatalog
+try:
+    from .billing_ranker import BillingRanker
+    RANKER_AVAILABLE = True
+except ImportError:
+    # numpy / scipy absents: correspondance simple par mots-clés
+    RANKER_AVAILABLE = False
 from ..audit import write_audit_event
 
+logger = logging.getLogger("billing_agent")
+
 MAPPING_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "mappings", "ramq_codes.json")
+# Catalogue compilé (tools/import_mappings.py --compiled); prioritaire sur le JSON s'il existe
+CATALOG_PATH = os.getenv("RAMQ_CATALOG_PATH") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "mappings", "ramq_catalog.bin")
+# Index BM25 précalculé à côté du catalogue (tools/import_mappings.py --compiled), lu par mmap
+RANKER_PATH = os.getenv("RAMQ_RANKER_PATH") or CATALOG_PATH + ".ranker"
 RAMQ_API_URL = os.getenv("RAMQ_API_URL")
 RAMQ_API_TOKEN = os.getenv("RAMQ_API_TOKEN")
+SUGGESTIONS_TOP_K = int(os.getenv("BILLING_SUGGESTIONS_TOP_K", "10"))
 
 def load_mappings() -> List[Dict[str, Any]]:
     try:
@@ -15,11 +29,66 @@ def load_mappings() -> List[Dict[str, Any]]:
     except Exception:
         return []
 
-MAPPINGS = load_mappings()
+def load_catalog() -> Optional[CompiledCatalog]:
+    try:
+        return CompiledCatalog(CATALOG_PATH) if os.path.exists(CATALOG_PATH) else None
+    except Exception:
+        return None
+
+CATALOG = load_catalog()
+MAPPINGS = load_mappings() if CATALOG is None else []
+_RANKER = None
+_RANKER_LOCK = threading.Lock()
+
+def _build_ranker():
+    if CATALOG is None:
+        return BillingRanker(MAPPINGS) if MAPPINGS else None
+    try:
+        # index partagé entre workers par le cache de pages; seuls les codes proposés sont décodés
+        return BillingRanker.load(RANKER_PATH, CATALOG.entry, CATALOG_PATH)
+    except (OSError, ValueError) as e:
+        logger.warning("index du classement inutilisable (%s): reconstruction en mémoire", e)
+        return BillingRanker(CATALOG.entries(), entry=CATALOG.entry)
+
+def get_ranker():
+    """
+    Index BM25: relu par mmap depuis RANKER_PATH si le catalogue compilé y correspond, sinon construit
+    (quelques secondes pour un catalogue complet). Chargé au démarrage de l'API (warm_ranker) et des
+    workers de transcription (avant le fork des tâches), sinon au premier appel; un seul fil le charge.
+    """
+    global _RANKER
+    if _RANKER is None and RANKER_AVAILABLE:
+        with _RANKER_LOCK:
+            if _RANKER is None:
+                _RANKER = _build_ranker()
+    return _RANKER
+
+async def warm_ranker():
+    await asyncio.get_running_loop().run_in_executor(None, get_ranker)
+
+def rank_codes(clinical_notes: List[str], language: str = "fr", top_k: int = SUGGESTIONS_TOP_K) -> List[List[Dict[str, Any]]]:
+    ranker = get_ranker()
+    if ranker is None:
+        return [simple_match_codes(note, language)[:top_k] for note in clinical_notes]
+    return ranker.rank_batch(clinical_notes, language, top_k)
+
+async def rank_codes_async(clinical_notes: List[str], language: str = "fr", top_k: int = SUGGESTIONS_TOP_K) -> List[List[Dict[str, Any]]]:
+    """Calcul numpy / scipy hors de la boucle d'événements (un lot de nuit prend plusieurs secondes)."""
+    return await asyncio.get_running_loop().run_in_executor(None, rank_codes, clinical_notes, language, top_k)
 
 def simple_match_codes(clinical_text: str, language: str = "fr") -> List[Dict[str, Any]]:
     text = clinical_text.lower() if clinical_text else ""
     suggestions = []
+    if CATALOG is not None:
+        for idx in CATALOG.match(text, language):
+            entry = CATALOG.entry(idx)
+            suggestions.append({
+                "icd10ca": entry.get("icd10ca"),
+                "ccp": entry.get("ccp"),
+                "label": entry.get("label", {}).get(language, entry.get("label", {}).get("en")),
+                "confidence": 0.8
+            })
+        return suggestions
     for entry in MAPPINGS:
         keywords = entry.get("keywords", {}).get(language, []) + entry.get("keywords", {}).get("en", [])
         for kw in keywords:
@@ -73,7 +142,7 @@ class BillingAgent(AgentBase):
         language = payload.get("language", "fr")
         actor = payload.get("actor", "unknown")
         write_audit_event("billing_propose_requested", actor, session_id, "requested", {"len": len(clinical_note)})
-        suggestions = simple_match_codes(clinical_note, language)
+        suggestions = (await rank_codes_async([clinical_note], language, payload.get("top_k", SUGGESTIONS_TOP_K)))[0]
         if not suggestions:
             write_audit_event("billing_propose_no_suggestions", actor, session_id, "no_suggestions", {})
             return {"suggestions": [], "message": {
@@ -85,6 +154,15 @@ class BillingAgent(AgentBase):
             "en": "Proposed codes (review). Confirm to submit."
         }[language]}
 
+    async def propose_batch(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Re-codage de nuit: payload['notes'] = [{'id', 'clinical_note'}], notés en un seul appel."""
+        notes = payload.get("notes", [])
+        language = payload.get("language", "fr")
+        actor = payload.get("actor", "unknown")
+        write_audit_event("billing_propose_batch_requested", actor, None, "requested", {"count": len(notes)})
+        ranked = await rank_codes_async([n.get("clinical_note", "") for n in notes], language, payload.get("top_k", SUGGESTIONS_TOP_K))
+        return {"results": [{"id": n.get("id"), "suggestions": s} for n, s in zip(notes, ranked)]}
+
     async def submit(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         actor = payload.get("actor", "unknown")
         if not payload.get("confirm", False):
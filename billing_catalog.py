@@ -0,0 +1,195 @@
+# app/agents/billing_catalog.py
+"""
+Catalogue de facturation compilé (RAMQ + CIM-10-CA), lisible par mmap.
+Produit par tools/import_mappings.py --compiled; chargé par billing_agent sans parser de JSON.
+
+Format (little-endian, version 1):
+    en-tête       "<4sHH10I" magic, version, max_ngram, n_strings, n_records, n_keywords, n_postings,
+                             n_raw_keywords, off_str_index, off_str_blob, off_records, off_keywords, off_postings
+                             (les mots-clés bruts suivent immédiatement les postings)
+    str_index     (n_strings + 1) x u32   décalages dans str_blob (chaînes UTF-8 internées)
+    str_blob      octets UTF-8
+    records       n_records x "<7I"       key, label_fr, label_en, icd10ca, ccp, raw_kw_first, raw_kw_count
+    keywords      n_keywords x "<3I"      mot-clé normalisé, premier posting, nb postings (trié par octets UTF-8)
+    postings      n_postings x "<2I"      index de record, masque de langue (1 = fr, 2 = en)
+    raw_keywords  n_raw_keywords x "<2I"  mot-clé d'origine, masque de langue (pour ré-export / mises à jour)
+
+Seul l'en-tête est lu au chargement; les pages sont partagées entre workers via le cache du noyau.
+"""
+import mmap
+import os
+import re
+import struct
+import unicodedata
+from typing import Dict, Any, List, Optional
+
+MAGIC = b"ARQC"
+VERSION = 1
+HEADER = struct.Struct("<4sHH10I")
+U32 = struct.Struct("<I")
+RECORD = struct.Struct("<7I")
+KEYWORD = struct.Struct("<3I")
+POSTING = struct.Struct("<2I")
+RAW_KEYWORD = struct.Struct("<2I")
+LANG_MASK = {"fr": 1, "en": 2}
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+def normalize(text: str) -> str:
+    """minuscules, sans accents, ponctuation -> espace simple ('Gonorrhée' -> 'gonorrhee')."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", stripped.casefold()).strip()
+
+def compile_catalog(entries: List[Dict[str, Any]], out_path: str):
+    strings: List[bytes] = []
+    string_ids: Dict[str, int] = {}
+
+    def intern(s: str) -> int:
+        s = s or ""
+        sid = string_ids.get(s)
+        if sid is None:
+            sid = string_ids[s] = len(strings)
+            strings.append(s.encode("utf-8"))
+        return sid
+
+    records = []
+    raw_keywords = []
+    index: Dict[str, Dict[int, int]] = {}
+    for rec_idx, entry in enumerate(entries):
+        label = entry.get("label", {})
+        first = len(raw_keywords)
+        for lang, mask in LANG_MASK.items():
+            for kw in entry.get("keywords", {}).get(lang, []):
+                raw_keywords.append((intern(kw), mask))
+                norm = normalize(kw)
+                if norm:
+                    postings = index.setdefault(norm, {})
+                    postings[rec_idx] = postings.get(rec_idx, 0) | mask
+        records.append((intern(entry.get("key", "")), intern(label.get("fr", "")), intern(label.get("en", "")),
+                        intern(entry.get("icd10ca", "")), intern(entry.get("ccp", "")), first, len(raw_keywords) - first))
+
+    keywords = []
+    postings_out = []
+    for norm in sorted(index, key=lambda k: k.encode("utf-8")):
+        keywords.append((intern(norm), len(postings_out), len(index[norm])))
+        postings_out.extend(sorted(index[norm].items()))
+    max_ngram = max((len(k.split()) for k in index), default=1)
+
+    str_index = bytearray()
+    offset = 0
+    for s in strings:
+        str_index += U32.pack(offset)
+        offset += len(s)
+    str_index += U32.pack(offset)
+    blob = b"".join(strings)
+
+    off_str_index = HEADER.size
+    off_str_blob = off_str_index + len(str_index)
+    off_records = off_str_blob + len(blob)
+    off_records += (-off_records) % 4  # alignement des tables u32
+    off_keywords = off_records + RECORD.size * len(records)
+    off_postings = off_keywords + KEYWORD.size * len(keywords)
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, max_ngram, len(strings), len(records), len(keywords), len(postings_out),
+                            len(raw_keywords), off_str_index, off_str_blob, off_records, off_keywords, off_postings))
+        f.write(str_index)
+        f.write(blob)
+        f.write(b"\0" * (off_records - off_str_blob - len(blob)))
+        for rec in records:
+            f.write(RECORD.pack(*rec))
+        for kw in keywords:
+            f.write(KEYWORD.pack(*kw))
+        for p in postings_out:
+            f.write(POSTING.pack(*p))
+        for rk in raw_keywords:
+            f.write(RAW_KEYWORD.pack(*rk))
+    # remplacement atomique: les workers ayant déjà mappé l'ancien fichier le gardent intact
+    os.replace(tmp_path, out_path)
+
+class CompiledCatalog:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.max_ngram, self.n_strings, self.n_records, self.n_keywords, self.n_postings,
+         self.n_raw_keywords, self._off_str_index, self._off_str_blob, self._off_records, self._off_keywords,
+         self._off_postings) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"Catalogue compilé invalide: {path}")
+        self._off_raw_keywords = self._off_postings + POSTING.size * self.n_postings
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def close(self):
+        self._mm.close()
+
+    def _string_bytes(self, sid: int) -> bytes:
+        pos = self._off_str_index + 4 * sid
+        start, end = struct.unpack_from("<2I", self._mm, pos)
+        return self._mm[self._off_str_blob + start:self._off_str_blob + end]
+
+    def _string(self, sid: int) -> str:
+        return self._string_bytes(sid).decode("utf-8")
+
+    def entry(self, idx: int) -> Dict[str, Any]:
+        key, label_fr, label_en, icd, ccp, kw_first, kw_count = RECORD.unpack_from(self._mm, self._off_records + RECORD.size * idx)
+        keywords = {"fr": [], "en": []}
+        for i in range(kw_first, kw_first + kw_count):
+            sid, mask = RAW_KEYWORD.unpack_from(self._mm, self._off_raw_keywords + RAW_KEYWORD.size * i)
+            for lang, bit in LANG_MASK.items():
+                if mask & bit:
+                    keywords[lang].append(self._string(sid))
+        return {
+            "key": self._string(key),
+            "label": {"fr": self._string(label_fr), "en": self._string(label_en)},
+            "icd10ca": self._string(icd),
+            "ccp": self._string(ccp),
+            "keywords": keywords,
+        }
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return [self.entry(i) for i in range(self.n_records)]
+
+    def _find_keyword(self, norm: bytes) -> Optional[int]:
+        lo, hi = 0, self.n_keywords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sid = U32.unpack_from(self._mm, self._off_keywords + KEYWORD.size * mid)[0]
+            probe = self._string_bytes(sid)
+            if probe < norm:
+                lo = mid + 1
+            elif probe > norm:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _postings(self, norm: str, wanted: int) -> List[int]:
+        kw_idx = self._find_keyword(norm.encode("utf-8"))
+        if kw_idx is None:
+            return []
+        _, first, count = KEYWORD.unpack_from(self._mm, self._off_keywords + KEYWORD.size * kw_idx)
+        out = []
+        for i in range(first, first + count):
+            rec, mask = POSTING.unpack_from(self._mm, self._off_postings + POSTING.size * i)
+            if mask & wanted:
+                out.append(rec)
+        return out
+
+    def lookup(self, keyword: str, language: str = "fr") -> List[int]:
+        """Index des records dont un mot-clé normalisé vaut `keyword` (langue demandée ou en)."""
+        return self._postings(normalize(keyword), LANG_MASK.get(language, 0) | LANG_MASK["en"])
+
+    def match(self, text: str, language: str = "fr") -> List[int]:
+        """Records dont un mot-clé (mot ou expression jusqu'à max_ngram mots) apparaît dans le texte, dans l'ordre du catalogue."""
+        tokens = normalize(text).split()
+        wanted = LANG_MASK.get(language, 0) | LANG_MASK["en"]
+        hits = set()
+        for i in range(len(tokens)):
+            for n in range(1, min(self.max_ngram, len(tokens) - i) + 1):
+                hits.update(self._postings(" ".join(tokens[i:i + n]), wanted))
+        return sorted(hits)
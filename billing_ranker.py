@@ -0,0 +1,280 @@
+# app/agents/billing_ranker.py
+"""
+Classement des codes de facturation par BM25 sur les mots-clés et libellés du catalogue.
+Le catalogue est une matrice creuse (termes x codes) pondérée BM25, calculée une fois;
+une note (ou un lot de notes) devient une matrice de requêtes et tous les codes sont notés
+par un seul produit matriciel creux.
+
+Confiance: le score d'un code est rapporté au meilleur score qu'une seule de ses expressions
+(mot-clé ou libellé) obtient sur ce code (couverture ~1.0 quand la note contient une expression complète,
+quelle que soit la taille du catalogue ou la longueur des libellés), puis calibrage de Platt
+    confiance = 1 / (1 + exp(A * couverture + B))
+A/B sont ajustés à la construction de l'index sur des pseudo-requêtes tirées du catalogue (chaque mot-clé
+ou libellé: 1 pour son code, 0 pour les autres codes qu'il touche); la confiance mesure donc la séparation
+des codes par le vocabulaire du catalogue, pas encore l'accord des cliniciens. Si l'ajustement est
+dégénéré (aucune expression partagée entre codes, ex: petit catalogue), PLATT_FALLBACK donne une
+confiance croissante avec la couverture. RANKER_PLATT_A / RANKER_PLATT_B, ajustés par fit_platt()
+sur la couverture des propositions acceptées / rejetées, remplacent ce calibrage.
+
+Index précalculé (tools/import_mappings.py --compiled écrit <catalogue>.ranker), lu par mmap:
+    en-tête   "<4sHHIIII32sdd" magic, version, réservé, n_terms, n_docs, nnz, largeur des termes,
+                               sha256 du catalogue compilé, A, B
+    indptr    (n_terms + 1) x i32     lignes CSR (termes)
+    indices   nnz x i32               codes
+    data      nnz x f32               poids BM25
+    doc_best  n_docs x f32            meilleur score d'une expression du code
+    terms     n_terms x largeur       termes normalisés (ASCII), triés, complétés par des zéros
+Les tableaux restent dans le cache de pages partagé entre workers; seuls les codes proposés sont décodés.
+"""
+import hashlib
+import math
+import mmap
+import os
+import random
+import struct
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+from .billing_catalog import normalize
+
+BM25_K1 = float(os.getenv("RANKER_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("RANKER_BM25_B", "0.75"))
+KEYWORD_WEIGHT = float(os.getenv("RANKER_KEYWORD_WEIGHT", "2.0"))  # un mot-clé pèse plus qu'un mot du libellé
+# calibrage explicite (les deux valeurs requises); sinon ajusté sur le catalogue
+PLATT_ENV = (os.getenv("RANKER_PLATT_A"), os.getenv("RANKER_PLATT_B"))
+PLATT_FALLBACK = (-6.0, 3.0)      # couverture 0.5 -> 0.5, expression complète -> 0.95
+PLATT_MIN_SLOPE = 1e-3            # |A| en deçà: la confiance ne dépendrait plus du score
+PLATT_SAMPLE = int(os.getenv("RANKER_PLATT_SAMPLE", "5000"))
+MIN_CONFIDENCE = float(os.getenv("RANKER_MIN_CONFIDENCE", "0.3"))
+MAX_NGRAM = 3
+
+MAGIC = b"ARQR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIII32sdd")
+
+_STOPWORDS = frozenset(
+    "a au aux avec d de des du en et l la le les ou par pour sans sur un une "
+    "an and as at by for in of on or the to with without".split()
+)
+
+def _terms(text: str, max_ngram: int = MAX_NGRAM) -> List[str]:
+    tokens = [t for t in normalize(text).split() if t not in _STOPWORDS]
+    out = []
+    for n in range(1, max_ngram + 1):
+        out.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+    return out
+
+def sidecar_path(catalog_path: str) -> str:
+    return catalog_path + ".ranker"
+
+def file_digest(path: str) -> bytes:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+def fit_platt(scores: Sequence[float], labels: Sequence[int], iterations: int = 50) -> Tuple[float, float]:
+    """Régression logistique 1D (Newton) : labels 1 = code retenu par le clinicien, 0 = rejeté."""
+    x = np.asarray(scores, dtype=np.float64)
+    y = np.asarray(labels, dtype=np.float64)
+    # cibles lissées de Platt pour éviter la sur-confiance sur petits échantillons
+    n_pos, n_neg = y.sum(), y.size - y.sum()
+    t = np.where(y > 0, (n_pos + 1) / (n_pos + 2), 1 / (n_neg + 2))
+    a, b = 0.0, math.log((n_neg + 1) / (n_pos + 1))
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(a * x + b))
+        # gradient / hessienne de la log-vraisemblance en (a, b)
+        d = t - p
+        w = p * (1 - p)
+        g = np.array([np.dot(d, x), d.sum()])
+        h = np.array([[np.dot(w, x * x), np.dot(w, x)], [np.dot(w, x), w.sum()]]) + 1e-9 * np.eye(2)
+        step = np.linalg.solve(h, g)
+        a, b = a - step[0], b - step[1]
+        if np.abs(step).max() < 1e-8:
+            break
+    return float(a), float(b)
+
+class BillingRanker:
+    def __init__(self, entries: Sequence[Dict[str, Any]], platt: Optional[Tuple[float, float]] = None,
+                 entry: Optional[Callable[[int], Dict[str, Any]]] = None):
+        """
+        entries: parcourues une fois pour construire l'index; entry(idx) relit un code proposé
+        (ex: CompiledCatalog.entry), sinon les entrées sont gardées en mémoire.
+        """
+        self._entry = entry or entries.__getitem__
+        self._mm = None
+        vocab: Dict[str, int] = {}
+        rows, cols, vals = [], [], []
+        phrases: List[Tuple[int, str, List[int]]] = []
+        n_docs = 0
+        for doc, item in enumerate(entries):
+            n_docs = doc + 1
+            tf: Dict[int, float] = {}
+            texts = [(kw, KEYWORD_WEIGHT) for kws in item.get("keywords", {}).values() for kw in kws]
+            texts += [(label, 1.0) for label in item.get("label", {}).values()]
+            for text, weight in texts:
+                tids = [vocab.setdefault(term, len(vocab)) for term in _terms(text)]
+                for tid in tids:
+                    tf[tid] = tf.get(tid, 0.0) + weight
+                if tids:
+                    phrases.append((doc, text, tids))
+            for tid, count in tf.items():
+                rows.append(tid)
+                cols.append(doc)
+                vals.append(count)
+        # termes triés (octets ASCII): recherche par dichotomie, identique à l'index relu par mmap
+        terms = sorted(vocab)
+        rank = np.empty(len(vocab), dtype=np.int64)
+        rank[[vocab[t] for t in terms]] = np.arange(len(terms))
+        self.terms = np.array([t.encode("ascii") for t in terms], dtype=f"S{max(map(len, terms), default=1)}")
+        rows = rank[np.asarray(rows, dtype=np.int64)]
+        tf_mat = sparse.csr_matrix((np.asarray(vals, dtype=np.float32), (rows, cols)), shape=(len(terms), n_docs))
+        df = np.diff(tf_mat.indptr).astype(np.float64)
+        idf = np.log1p((max(n_docs, 1) - df + 0.5) / (df + 0.5))
+        dl = np.asarray(tf_mat.sum(axis=0)).ravel()
+        avgdl = dl.mean() if dl.size else 1.0
+        # BM25 appliqué élément par élément sur les valeurs non nulles (COO -> CSR)
+        coo = tf_mat.tocoo()
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * dl[coo.col] / avgdl)
+        weights = idf[coo.row] * coo.data * (BM25_K1 + 1) / (coo.data + norm)
+        self._weights = sparse.csr_matrix((weights.astype(np.float32), (coo.row, coo.col)), shape=tf_mat.shape)
+        # meilleur score d'une seule expression sur son propre code (présence des termes, comme _query_matrix)
+        self._doc_best = np.zeros(n_docs, dtype=np.float32)
+        if phrases:
+            owners = np.fromiter((doc for doc, _, _ in phrases), dtype=np.int64, count=len(phrases))
+            indptr = np.cumsum([0] + [len(tids) for _, _, tids in phrases])
+            presence = sparse.csr_matrix((np.ones(indptr[-1], dtype=np.float32),
+                                          rank[np.concatenate([tids for _, _, tids in phrases])], indptr),
+                                         shape=(len(phrases), len(terms)))
+            presence.sum_duplicates()
+            presence.data[:] = 1.0
+            own = np.asarray(presence.multiply(self._weights.T.tocsr()[owners]).sum(axis=1)).ravel()
+            np.maximum.at(self._doc_best, owners, own.astype(np.float32))
+        if platt is None and all(PLATT_ENV):
+            platt = (float(PLATT_ENV[0]), float(PLATT_ENV[1]))
+        self.platt = platt if platt is not None else self._catalog_platt(phrases)
+
+    @classmethod
+    def load(cls, path: str, entry: Callable[[int], Dict[str, Any]], catalog_path: Optional[str] = None) -> "BillingRanker":
+        """Relit l'index écrit par save(); ValueError s'il ne correspond pas au catalogue compilé."""
+        self = cls.__new__(cls)
+        self._entry = entry
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n_terms, n_docs, nnz, width, digest, a, b = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            raise ValueError(f"Index du classement invalide: {path}")
+        if catalog_path is not None and digest != file_digest(catalog_path):
+            mm.close()
+            raise ValueError(f"Index du classement périmé (catalogue recompilé): {path}")
+        offset = HEADER.size
+        arrays = []
+        for dtype, count in ((np.int32, n_terms + 1), (np.int32, nnz), (np.float32, nnz), (np.float32, n_docs)):
+            arrays.append(np.frombuffer(mm, dtype=dtype, count=count, offset=offset))
+            offset += arrays[-1].nbytes
+        indptr, indices, data, self._doc_best = arrays
+        self.terms = np.frombuffer(mm, dtype=f"S{width}", count=n_terms, offset=offset)
+        # vues en lecture seule sur le mmap (aucune copie): partagées entre processus par le cache de pages
+        self._weights = sparse.csr_matrix((data, indices, indptr), shape=(n_terms, n_docs), copy=False)
+        self._mm = mm
+        self.platt = (float(PLATT_ENV[0]), float(PLATT_ENV[1])) if all(PLATT_ENV) else (a, b)
+        return self
+
+    def save(self, path: str, catalog_path: str):
+        """Écrit l'index (remplacement atomique) à côté du catalogue compilé dont il dépend."""
+        w = self._weights
+        header = HEADER.pack(MAGIC, VERSION, 0, len(self.terms), w.shape[1], w.nnz, self.terms.dtype.itemsize,
+                             file_digest(catalog_path), self.platt[0], self.platt[1])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            for arr, dtype in ((w.indptr, np.int32), (w.indices, np.int32), (w.data, np.float32), (self._doc_best, np.float32)):
+                f.write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+            f.write(self.terms.tobytes())
+        os.replace(tmp_path, path)
+
+    def _catalog_platt(self, phrases: List[Tuple[int, str, List[int]]], sample: int = PLATT_SAMPLE,
+                       seed: int = 0) -> Tuple[float, float]:
+        """Ajuste A/B sur des pseudo-requêtes du catalogue (échantillon fixe: index reproductible)."""
+        queries = sorted({(doc, text) for doc, text, _ in phrases})
+        if len(queries) > sample:
+            queries = sorted(random.Random(seed).sample(queries, sample))
+        scores = self.score([text for _, text in queries]) if queries else None
+        if scores is None or scores.nnz == 0:
+            return PLATT_FALLBACK
+        x, y = [], []
+        for i, (owner, _) in enumerate(queries):
+            row = scores.getrow(i)
+            x.extend(self._coverage(row.indices, row.data))
+            y.extend(row.indices == owner)
+        y = np.asarray(y, dtype=np.int8)
+        if y.min() == y.max():
+            # aucune expression ne touche un autre code: rien à séparer
+            return PLATT_FALLBACK
+        a, b = fit_platt(x, y)
+        return (a, b) if a < -PLATT_MIN_SLOPE else PLATT_FALLBACK
+
+    def _coverage(self, docs: np.ndarray, raw: np.ndarray) -> np.ndarray:
+        best = self._doc_best[docs]
+        return np.divide(raw, best, out=np.zeros(raw.shape, dtype=np.float64), where=best > 0)
+
+    def _lookup(self, terms: List[str]) -> np.ndarray:
+        # un terme plus long que la largeur serait tronqué par numpy: il ne peut pas être dans l'index
+        width = self.terms.dtype.itemsize
+        probe = [t.encode("ascii") for t in terms if len(t) <= width]
+        if not probe or not len(self.terms):
+            return np.empty(0, dtype=np.int64)
+        probe = np.array(probe, dtype=self.terms.dtype)
+        pos = np.minimum(np.searchsorted(self.terms, probe), len(self.terms) - 1)
+        return np.unique(pos[self.terms[pos] == probe])
+
+    def _query_matrix(self, notes: Sequence[str]) -> sparse.csr_matrix:
+        indptr, indices = [0], []
+        for note in notes:
+            # présence (et non fréquence) du terme dans la note: une répétition ne gonfle pas le score
+            indices.extend(self._lookup(_terms(note or "")).tolist())
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(notes), len(self.terms)))
+
+    def score(self, notes: Sequence[str]) -> sparse.csr_matrix:
+        """Scores BM25 bruts (notes x codes), creux."""
+        return (self._query_matrix(notes) @ self._weights).tocsr()
+
+    def calibrate(self, docs: np.ndarray, raw: np.ndarray) -> np.ndarray:
+        a, b = self.platt
+        return 1.0 / (1.0 + np.exp(a * self._coverage(docs, raw) + b))
+
+    def rank_batch(self, notes: Sequence[str], language: str = "fr", top_k: int = 10,
+                   min_confidence: float = MIN_CONFIDENCE) -> List[List[Dict[str, Any]]]:
+        scores = self.score(notes)
+        results = []
+        for i in range(scores.shape[0]):
+            row = scores.getrow(i)
+            if row.nnz == 0:
+                results.append([])
+                continue
+            conf = self.calibrate(row.indices, row.data)
+            keep = conf >= min_confidence
+            docs, raw, conf = row.indices[keep], row.data[keep], conf[keep]
+            if docs.size > top_k:
+                part = np.argpartition(-raw, top_k - 1)[:top_k]
+                docs, raw, conf = docs[part], raw[part], conf[part]
+            order = np.argsort(-raw, kind="stable")
+            ranked = []
+            for doc, r, c in zip(docs[order], raw[order], conf[order]):
+                entry = self._entry(int(doc))
+                ranked.append({
+                    "icd10ca": entry.get("icd10ca"),
+                    "ccp": entry.get("ccp"),
+                    "label": entry.get("label", {}).get(language, entry.get("label", {}).get("en")),
+                    "confidence": round(float(c), 3),
+                    "score": round(float(r), 4),
+                })
+            results.append(ranked)
+        return results
+
+    def rank(self, note: str, language: str = "fr", top_k: int = 10, min_confidence: float = MIN_CONFIDENCE) -> List[Dict[str, Any]]:
+        return self.rank_batch([note], language, top_k, min_confidence)[0]
@@ -0,0 +1,47 @@
+# app/encryption.py
+import os
+from typing import Dict
+from cryptography.fernet import Fernet, InvalidToken
+
+_FERNETS: Dict[str, Fernet] = {}
+
+class MissingKeyError(RuntimeError):
+    """Clé Fernet absente ou invalide: les données chiffrées doivent rester lisibles par tous les processus."""
+
+def get_fernet(env_var: str) -> Fernet:
+    """
+    Fernet (AES-128-CBC + HMAC) à partir d'une clé fournie par variable d'environnement.
+    La clé est obligatoire: une clé éphémère par processus rendrait les données illisibles
+    pour les autres workers (en prod: clé issue du KMS, partagée entre l'API et les workers).
+    """
+    f = _FERNETS.get(env_var)
+    if f is None:
+        key = (os.getenv(env_var) or "").strip()
+        if not key:
+            raise MissingKeyError(f"{env_var} is not set")
+        try:
+            f = Fernet(key.encode())
+        except ValueError as e:
+            raise MissingKeyError(f"{env_var} is not a valid Fernet key") from e
+        _FERNETS[env_var] = f
+    return f
+
+def require_keys(*env_vars: str):
+    """Vérification au démarrage (API, workers): lève MissingKeyError pour toutes les clés absentes ou invalides."""
+    errors = []
+    for env_var in env_vars:
+        try:
+            get_fernet(env_var)
+        except MissingKeyError as e:
+            errors.append(str(e))
+    if errors:
+        raise MissingKeyError("; ".join(errors) + ' (python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())")')
+
+def encrypt_bytes(env_var: str, data: bytes) -> bytes:
+    return get_fernet(env_var).encrypt(data)
+
+def decrypt_bytes(env_var: str, token: bytes, ttl: int = None) -> bytes:
+    """Lève InvalidToken si la clé diffère, si le jeton est altéré ou plus vieux que ttl secondes."""
+    return get_fernet(env_var).decrypt(token, ttl=ttl)
+
+__all__ = ["get_fernet", "require_keys", "encrypt_bytes", "decrypt_bytes", "InvalidToken", "MissingKeyError"]
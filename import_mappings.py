@@ -1,28 +1,95 @@
 # tools/import_mappings.py
-import csv, json, sys
-from typing import List
+import argparse, csv, json, os, sys
+from typing import List, Dict, Any
+
+# permet `python tools/import_mappings.py` depuis la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 def parse_keywords(field: str):
     if not field:
         return []
     return [k.strip() for k in field.split(';') if k.strip()]
 
-def convert(csv_path: str):
-    out = []
+def row_to_entry(row: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "key": row.get("key"),
+        "label": {"fr": row.get("label_fr",""), "en": row.get("label_en","")},
+        "icd10ca": row.get("icd10ca",""),
+        "ccp": row.get("ccp",""),
+        "keywords": {"fr": parse_keywords(row.get("keywords_fr","")), "en": parse_keywords(row.get("keywords_en",""))}
+    }
+
+def read_entries(csv_path: str) -> List[Dict[str, Any]]:
     with open(csv_path, newline='', encoding='utf-8') as f:
-        r = csv.DictReader(f)
-        for row in r:
-            out.append({
-                "key": row.get("key"),
-                "label": {"fr": row.get("label_fr",""), "en": row.get("label_en","")},
-                "icd10ca": row.get("icd10ca",""),
-                "ccp": row.get("ccp",""),
-                "keywords": {"fr": parse_keywords(row.get("keywords_fr","")), "en": parse_keywords(row.get("keywords_en",""))}
-            })
-    print(json.dumps(out, ensure_ascii=False, indent=2))
+        return [row_to_entry(row) for row in csv.DictReader(f)]
+
+def apply_diff(entries: List[Dict[str, Any]], diff_csv_path: str) -> List[Dict[str, Any]]:
+    """
+    Applique un CSV de différences: mêmes colonnes que l'import + colonne 'op' (upsert par défaut, ou delete).
+    Les entrées existantes gardent leur position; les nouvelles sont ajoutées à la fin.
+    """
+    by_key = {e["key"]: i for i, e in enumerate(entries)}
+    out = list(entries)
+    deleted = set()
+    with open(diff_csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            op = (row.get("op") or "upsert").strip().lower()
+            key = row.get("key")
+            if op == "delete":
+                if key in by_key:
+                    deleted.add(by_key[key])
+            elif op in ("upsert", "add", "update"):
+                entry = row_to_entry(row)
+                if key in by_key:
+                    out[by_key[key]] = entry
+                    deleted.discard(by_key[key])
+                else:
+                    by_key[key] = len(out)
+                    out.append(entry)
+            else:
+                raise ValueError(f"op inconnue pour {key}: {op}")
+    return [e for i, e in enumerate(out) if i not in deleted]
+
+def convert(csv_path: str):
+    print(json.dumps(read_entries(csv_path), ensure_ascii=False, indent=2))
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import des correspondances RAMQ / CIM-10-CA")
+    parser.add_argument("csv_path", nargs="?", help="CSV complet (key,label_fr,label_en,icd10ca,ccp,keywords_fr,keywords_en)")
+    parser.add_argument("--compiled", metavar="OUT", help="écrire un catalogue binaire compilé (mmap) et son index de classement (OUT.ranker) au lieu du JSON")
+    parser.add_argument("--base", help="catalogue compilé existant à mettre à jour (avec --diff)")
+    parser.add_argument("--diff", help="CSV de différences (colonne op: upsert|delete)")
+    args = parser.parse_args(argv)
+    if not args.csv_path and not args.base:
+        parser.print_usage(sys.stderr)
+        return 2
+    if not args.compiled:
+        if args.base or args.diff:
+            print("--base/--diff exigent --compiled", file=sys.stderr)
+            return 2
+        convert(args.csv_path)
+        return 0
+    from app.agents.billing_catalog import CompiledCatalog, compile_catalog
+    if args.base:
+        catalog = CompiledCatalog(args.base)
+        entries = catalog.entries()
+        catalog.close()
+    else:
+        entries = read_entries(args.csv_path)
+    if args.diff:
+        entries = apply_diff(entries, args.diff)
+    compile_catalog(entries, args.compiled)
+    print(f"{len(entries)} entrées -> {args.compiled}", file=sys.stderr)
+    try:
+        from app.agents.billing_ranker import BillingRanker, sidecar_path
+    except ImportError:
+        # numpy / scipy absents: l'API construira l'index en mémoire si elle les a
+        print("numpy/scipy absents: index du classement non écrit", file=sys.stderr)
+        return 0
+    ranker_path = sidecar_path(args.compiled)
+    BillingRanker(entries).save(ranker_path, args.compiled)
+    print(f"index du classement -> {ranker_path}", file=sys.stderr)
+    return 0
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python tools/import_mappings.py path/to/mappings.csv", file=sys.stderr)
-        sys.exit(2)
-    convert(sys.argv[1])
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# app/agents/incremental.py
+"""
+Re-scribe incrémental après correction de la transcription par le clinicien.
+La transcription est découpée en unités (phrases / lignes); on compare les empreintes des unités
+avec la version précédente (conservée en session: empreinte, longueur et plages à masquer de chaque
+unité, jamais le texte) et seules les unités modifiées, plus leurs voisines à moins de
+STREAM_BOUNDARY_WINDOW caractères, sont analysées à nouveau, avec ce même contexte de part et d'autre:
+une donnée identifiante à cheval sur deux unités (« 514\n555-1234 ») est masquée d'un seul tenant,
+comme par redact_text sur le texte entier. Les sections ne sont ré-extraites que si leur entrée rédigée change.
+"""
+import difflib
+import hashlib
+import re
+from typing import Dict, Any, List, Tuple
+from ..policy_redaction import find_pii_spans, merge_spans, apply_spans, detect_flags, STREAM_BOUNDARY_WINDOW
+
+# Coupure après une fin de phrase suivie d'une majuscule, ou sur saut de ligne:
+# un numéro « 514. 555 1234 » ou une adresse courriel ne sont jamais coupés.
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-ZÀ-ÖØ-Þ])|\n+")
+
+def split_units(text: str) -> List[str]:
+    """Unités contiguës: ''.join(split_units(t)) == t."""
+    units = []
+    pos = 0
+    for m in _BOUNDARY.finditer(text):
+        units.append(text[pos:m.end()])
+        pos = m.end()
+    if pos < len(text):
+        units.append(text[pos:])
+    return units
+
+def content_hash(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:32]
+
+def _units_state(units: List[str], hashes: List[str], spans: List[Tuple[int, int, str]]) -> List[Dict[str, Any]]:
+    """Chaque plage est rattachée à l'unité où elle commence (décalages relatifs, fin possiblement au-delà)."""
+    state = []
+    offset = 0
+    k = 0
+    for unit, h in zip(units, hashes):
+        end = offset + len(unit)
+        own = []
+        while k < len(spans) and spans[k][0] < end:
+            start, stop, category = spans[k]
+            own.append([start - offset, stop - offset, category])
+            k += 1
+        state.append({"h": h, "n": len(unit), "s": own})
+        offset = end
+    return state
+
+def units_state(transcript: str, redaction_log: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """État des unités à partir d'une rédaction déjà faite sur le texte entier (premier passage)."""
+    units = split_units(transcript)
+    spans = sorted((e["start"], e["start"] + e["length"], e["category"]) for e in redaction_log)
+    return _units_state(units, [content_hash(u) for u in units], spans)
+
+def incremental_redact(transcript: str, prev_units: List[Dict[str, Any]], window: int = STREAM_BOUNDARY_WINDOW) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Retourne (policy_result, units_state, stats); policy_result est identique à policy_check_and_redact
+    tant qu'aucune donnée identifiante ne dépasse `window` caractères.
+    units_state: [{"h": empreinte, "n": longueur originale, "s": [[début, fin, catégorie], ...]}]
+    """
+    units = split_units(transcript)
+    hashes = [content_hash(u) for u in units]
+    bounds = [0]
+    for unit in units:
+        bounds.append(bounds[-1] + len(unit))
+    # état d'une version antérieure (texte rédigé par unité, sans plages): tout est réanalysé
+    matcher = difflib.SequenceMatcher(a=[u.get("h") if "s" in u else None for u in prev_units], b=hashes, autojunk=False)
+    reused: Dict[int, List[List[Any]]] = {}
+    changes: List[Tuple[int, int]] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(j2 - j1):
+                reused[j1 + k] = prev_units[i1 + k]["s"]
+        else:
+            # plage modifiée du nouveau texte (vide pour une suppression: point de jonction)
+            changes.append((bounds[j1], bounds[j2]))
+    # unités à réanalyser: modifiées, ou assez proches d'une modification pour qu'une plage les relie
+    dirty = [any(bounds[j] <= b + window and bounds[j + 1] >= a - window for a, b in changes) for j in range(len(units))]
+    spans: List[Tuple[int, int, str]] = []
+    j = 0
+    while j < len(units):
+        if not dirty[j]:
+            spans.extend((bounds[j] + s, bounds[j] + e, c) for s, e, c in reused[j])
+            j += 1
+            continue
+        k = j
+        while k < len(units) and dirty[k]:
+            k += 1
+        # région [bounds[j], bounds[k]) analysée avec `window` caractères de contexte de chaque côté;
+        # seules les plages qui y commencent lui appartiennent
+        lo, hi = max(0, bounds[j] - window), min(len(transcript), bounds[k] + window)
+        for s, e, c in find_pii_spans(transcript[lo:hi]):
+            if bounds[j] <= lo + s < bounds[k]:
+                spans.append((lo + s, lo + e, c))
+        j = k
+    spans = merge_spans(spans)
+    redacted, redaction_log = apply_spans(transcript, spans)
+    policy_result = {
+        "redacted_transcript": redacted,
+        "redaction_log": redaction_log,
+        # recherche de mots-clés sur tout le texte: peu coûteuse et indépendante du découpage
+        "flags": detect_flags(transcript),
+    }
+    return policy_result, _units_state(units, hashes, spans), {"units_total": len(units), "units_redacted": sum(dirty)}
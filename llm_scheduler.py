@@ -0,0 +1,269 @@
+# app/agents/llm_scheduler.py
+"""
+Ordonnanceur des appels LLM partagé par tous les agents texte.
+- plafond de concurrence global et par modèle
+- comptabilité jetons/minute (TPM) par modèle, avec réservation à l'admission puis ajustement à l'usage réel
+- classes de priorité: "interactive" (/scribe, /transcribe) passe avant "batch"
+- sur 429: division par deux de la concurrence du modèle, pause (Retry-After ou exponentielle + gigue),
+  puis remontée additive au fil des succès
+- métriques d'attente en file par priorité (scheduler.metrics())
+
+Configuration:
+    LLM_MAX_CONCURRENCY=16
+    LLM_MODEL_CONCURRENCY="gpt-4o-mini=8,gpt-4o=4"
+    LLM_TPM_LIMITS="gpt-4o-mini=200000"
+    LLM_BATCH_MAX_SHARE=0.5      # part des créneaux accessible au batch (global et par modèle)
+
+Les limites sont tenues en mémoire, par processus: avec N processus qui appellent le fournisseur
+(workers uvicorn, workers RQ de transcription), configurer chacun avec le quota du compte / N
+(ex. TPM 400000 partagé par 2 processus: LLM_TPM_LIMITS="gpt-4o-mini=200000").
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+BATCH_MAX_SHARE = float(os.getenv("LLM_BATCH_MAX_SHARE", "0.5"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "1.0"))
+BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "30"))
+EST_COMPLETION_TOKENS = int(os.getenv("LLM_EST_COMPLETION_TOKENS", "512"))
+_TPM_WINDOW_S = 60.0
+_WAIT_SAMPLES = 1000
+
+def _parse_limits(raw: str) -> Dict[str, int]:
+    out = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            model, value = item.split("=", 1)
+            out[model.strip()] = int(value)
+    return out
+
+MODEL_CONCURRENCY = _parse_limits(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+TPM_LIMITS = _parse_limits(os.getenv("LLM_TPM_LIMITS", ""))
+
+def _status_code(exc: Exception) -> Optional[int]:
+    for attr in ("status_code", "http_status"):
+        code = getattr(exc, attr, None)
+        if isinstance(code, int):
+            return code
+    resp = getattr(exc, "response", None)
+    return getattr(resp, "status_code", None)
+
+def _is_rate_limit(exc: Exception) -> bool:
+    return _status_code(exc) == 429 or type(exc).__name__ == "RateLimitError"
+
+def _is_transient(exc: Exception) -> bool:
+    code = _status_code(exc)
+    if code is not None:
+        return code >= 500
+    return type(exc).__name__ in ("APITimeoutError", "APIConnectionError", "Timeout", "ServiceUnavailableError")
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class _ModelState:
+    def __init__(self, model: str):
+        self.cap = MODEL_CONCURRENCY.get(model, MAX_CONCURRENCY)
+        self.limit = self.cap            # limite adaptative (AIMD)
+        self.in_flight = 0
+        self.in_flight_batch = 0
+        self.tpm = TPM_LIMITS.get(model)
+        self.window: deque = deque()     # [horodatage, jetons] des 60 dernières secondes
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.rate_limited = 0
+
+    def tokens_in_window(self, now: float) -> int:
+        while self.window and self.window[0][0] <= now - _TPM_WINDOW_S:
+            self.window.popleft()
+        return sum(e[1] for e in self.window)
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.in_flight_batch = 0
+        self._models: Dict[str, _ModelState] = {}
+        self._waiters: List = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._waits: Dict[str, deque] = {p: deque(maxlen=_WAIT_SAMPLES) for p in PRIORITIES}
+        self._counts: Dict[str, int] = {p: 0 for p in PRIORITIES}
+
+    def _model(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(model)
+        return state
+
+    def _fits(self, priority: str, state: _ModelState, tokens: int, now: float) -> bool:
+        if self.in_flight >= self.max_concurrency or state.in_flight >= state.limit or now < state.cooldown_until:
+            return False
+        if priority == "batch":
+            # part réservée à l'interactif, globalement et sur chaque modèle (limite AIMD courante)
+            if self.in_flight_batch >= max(1, int(self.max_concurrency * BATCH_MAX_SHARE)):
+                return False
+            if state.in_flight_batch >= max(1, int(state.limit * BATCH_MAX_SHARE)):
+                return False
+        if state.tpm and state.tokens_in_window(now) + tokens > state.tpm and state.window:
+            return False
+        return True
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        blocked = []
+        starved = set()  # modèles où un appel interactif attend: le batch ne le double pas
+        next_check = None
+        while self._waiters:
+            item = heapq.heappop(self._waiters)
+            _, _, priority, model, tokens, fut = item
+            if fut.done():
+                continue
+            state = self._model(model)
+            if (priority == "batch" and model in starved) or not self._fits(priority, state, tokens, now):
+                blocked.append(item)
+                if priority == "interactive":
+                    starved.add(model)
+                if now < state.cooldown_until:
+                    next_check = min(next_check or state.cooldown_until, state.cooldown_until)
+                elif state.tpm and state.window:
+                    expiry = state.window[0][0] + _TPM_WINDOW_S
+                    next_check = min(next_check or expiry, expiry)
+                continue
+            entry = [now, tokens]
+            state.window.append(entry)
+            state.in_flight += 1
+            self.in_flight += 1
+            if priority == "batch":
+                self.in_flight_batch += 1
+                state.in_flight_batch += 1
+            fut.set_result(entry)
+        for item in blocked:
+            heapq.heappush(self._waiters, item)
+        if blocked and next_check is not None:
+            # rien ne libérera de créneau avant la fin de la pause / de la fenêtre TPM
+            self._timer = asyncio.get_running_loop().call_later(max(0.0, next_check - now), self._dispatch)
+
+    def _release(self, priority: str, state: _ModelState):
+        state.in_flight -= 1
+        self.in_flight -= 1
+        if priority == "batch":
+            self.in_flight_batch -= 1
+            state.in_flight_batch -= 1
+        self._kick()
+
+    def _kick(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def _acquire(self, priority: str, model: str, tokens: int):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), priority, model, tokens, fut))
+        self._kick()
+        started = time.monotonic()
+        try:
+            entry = await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # créneau attribué pendant l'annulation: le rendre
+                self._release(priority, self._model(model))
+            raise
+        wait = time.monotonic() - started
+        self._waits[priority].append(wait)
+        self._counts[priority] += 1
+        return entry
+
+    def _on_rate_limited(self, state: _ModelState, attempt: int, exc: Exception) -> float:
+        state.rate_limited += 1
+        state.successes = 0
+        state.limit = max(1, state.limit // 2)
+        delay = _retry_after(exc) or min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)) * (0.5 + random.random())
+        state.cooldown_until = max(state.cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def _on_success(self, state: _ModelState):
+        state.successes += 1
+        if state.limit < state.cap and state.successes >= state.limit:
+            state.limit += 1
+            state.successes = 0
+
+    async def agenerate(self, llm, messages: List[List[Any]], priority: str = "interactive", est_tokens: int = None):
+        """Équivalent de llm.agenerate(messages=...) soumis aux limites de l'ordonnanceur."""
+        priority = priority if priority in PRIORITIES else "interactive"
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or "default"
+        if est_tokens is None:
+            chars = sum(len(getattr(m, "content", "") or "") for prompt in messages for m in prompt)
+            est_tokens = chars // 4 + EST_COMPLETION_TOKENS
+        state = self._model(model)
+        attempt = 0
+        while True:
+            entry = await self._acquire(priority, model, est_tokens)
+            try:
+                resp = await llm.agenerate(messages=messages)
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not (_is_rate_limit(e) or _is_transient(e)):
+                    raise
+                if _is_rate_limit(e):
+                    delay = self._on_rate_limited(state, attempt, e)
+                else:
+                    delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)) * (0.5 + random.random())
+                attempt += 1
+            else:
+                usage = (getattr(resp, "llm_output", None) or {}).get("token_usage") or {}
+                if usage.get("total_tokens"):
+                    entry[1] = usage["total_tokens"]
+                self._on_success(state)
+                return resp
+            finally:
+                self._release(priority, state)
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        queued: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        for item in self._waiters:
+            if not item[5].done():
+                queued[item[2]] += 1
+        waits = {}
+        for p, samples in self._waits.items():
+            ordered = sorted(samples)
+            waits[p] = {
+                "count": self._counts[p],
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else None,
+                "max_ms": round(ordered[-1] * 1000, 1) if ordered else None,
+            }
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queued": queued,
+            "queue_wait": waits,
+            "models": {
+                name: {
+                    "in_flight": s.in_flight,
+                    "in_flight_batch": s.in_flight_batch,
+                    "limit": s.limit,
+                    "cap": s.cap,
+                    "tokens_last_minute": s.tokens_in_window(now),
+                    "tpm_limit": s.tpm,
+                    "rate_limited": s.rate_limited,
+                    "cooldown_s": round(max(0.0, s.cooldown_until - now), 2),
+                }
+                for name, s in self._models.items()
+            },
+        }
+
+scheduler = LLMScheduler()
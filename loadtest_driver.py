@@ -0,0 +1,257 @@
+# tools/loadtest_driver.py
+"""
+Rejoue un mélange de trafic réaliste contre l'API FastAPI et produit un rapport de latence / erreurs.
+À utiliser avec tools/loadtest_stubs.py (l'API et le worker RQ pointés vers les services de remplacement).
+    python tools/loadtest_driver.py --base-url http://localhost:8000 --token "$JWT" \
+        --mix scribe=6,propose=3,submit=1,transcribe=1 --concurrency 16 --duration 120 --audio samples/*.wav
+
+Scénarios:
+    transcribe  POST /transcribe (fichiers --audio)
+    scribe      POST /scribe (transcriptions synthétiques; --incremental-share rejoue une version corrigée)
+    propose     POST /billing/propose
+    submit      POST /billing/submit (jeton avec scope billing.submit; réclamation traitée par le worker RQ)
+    fhir, mado  appels directs à FHIRClient.post_resource / transmit_mado dans un pool de threads:
+                ces chemins ne sont pas exposés sans confirmation clinique par l'API
+--rate N: arrivées ouvertes (N requêtes/s, indépendamment des réponses); sinon boucle fermée (--concurrency).
+"""
+import argparse, asyncio, glob, json, os, random, sys, time, uuid
+from collections import defaultdict
+from typing import Dict, Any, List, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_COMPLAINTS = [
+    "écoulement urétral depuis trois jours", "lésions génitales douloureuses", "brûlures mictionnelles",
+    "dépistage ITSS après un nouveau partenaire", "douleur pelvienne et fièvre", "éruption cutanée non prurigineuse",
+]
+_HISTORY = [
+    "Pas d'antécédent d'ITSS.", "Traité pour une chlamydia l'an dernier.", "Utilise le condom de façon irrégulière.",
+    "Allergie à la pénicilline.", "Aucun médicament régulier.", "Partenaire récemment diagnostiqué avec une gonorrhée.",
+]
+_PLANS = [
+    "Prélèvements TAAN chlamydia et gonorrhée, sérologies VIH et syphilis.", "Ceftriaxone 500 mg IM dose unique.",
+    "Doxycycline 100 mg BID pendant 7 jours.", "Retour dans deux semaines pour les résultats.", "Notification des partenaires discutée.",
+]
+_CODES = [["A56.0"], ["A54.0"], ["A60.0"], ["Z11.3"], ["A56.0", "A54.0"]]
+
+def synthetic_transcript(rng: random.Random, sentences: int = 20, pii_share: float = 0.3, mado_share: float = 0.02) -> str:
+    parts = [f"Patient consulte pour {rng.choice(_COMPLAINTS)}."]
+    for _ in range(sentences):
+        parts.append(rng.choice(_HISTORY + _PLANS))
+    if rng.random() < pii_share:
+        parts.insert(1, f"On peut le joindre au 514-{rng.randint(200, 999)}-{rng.randint(1000, 9999)} ou à patient{rng.randint(1, 999)}@exemple.ca.")
+    if rng.random() < mado_share:
+        parts.append("Rapporte une agression sexuelle il y a une semaine.")
+    return " ".join(parts)
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    mix = {}
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        if float(weight or 1) > 0:
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+def _pct(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, scenario: str, latency_s: float, status: str, ok: bool):
+        self.latencies[scenario].append(latency_s * 1000)
+        self.statuses[scenario][status] += 1
+        if not ok:
+            self.errors[scenario] += 1
+
+    def report(self, elapsed_s: float) -> Dict[str, Any]:
+        out = {}
+        for scenario, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            out[scenario] = {
+                "count": len(ordered),
+                "rps": round(len(ordered) / elapsed_s, 2) if elapsed_s > 0 else None,
+                "error_rate": round(self.errors[scenario] / len(ordered), 4),
+                "p50_ms": round(_pct(ordered, 0.50), 1),
+                "p90_ms": round(_pct(ordered, 0.90), 1),
+                "p99_ms": round(_pct(ordered, 0.99), 1),
+                "max_ms": round(ordered[-1], 1),
+                "statuses": dict(self.statuses[scenario]),
+            }
+        return out
+
+class Driver:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.mix = parse_mix(args.mix)
+        self.audio = sorted(f for pattern in args.audio for f in glob.glob(pattern))
+        if "transcribe" in self.mix and not self.audio:
+            raise SystemExit("scénario transcribe: fournir --audio")
+        self.recorder = Recorder()
+        self.sessions: List[Tuple[str, str]] = []   # sessions /scribe réussies, réutilisées par submit et le mode incrémental
+        self.client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout,
+                                        headers={"Authorization": f"Bearer {args.token}"} if args.token else {},
+                                        limits=httpx.Limits(max_connections=args.concurrency * 2))
+        self._direct = {}
+
+    def pick(self) -> str:
+        names = list(self.mix)
+        return self.rng.choices(names, weights=[self.mix[n] for n in names])[0]
+
+    async def _http(self, method: str, url: str, **kw) -> httpx.Response:
+        return await self.client.request(method, url, **kw)
+
+    async def transcribe(self):
+        path = self.rng.choice(self.audio)
+        with open(path, "rb") as f:
+            data = f.read()
+        session = uuid.uuid4().hex
+        return await self._http("POST", "/transcribe", params={"session": session, "language": "fr"},
+                                 files={"audio": (os.path.basename(path), data, "application/octet-stream")})
+
+    async def scribe(self):
+        if self.sessions and self.rng.random() < self.args.incremental_share:
+            # correction par le clinicien: même session, une phrase ajoutée
+            session, transcript = self.rng.choice(self.sessions)
+            transcript = transcript + " " + self.rng.choice(_PLANS)
+        else:
+            session = uuid.uuid4().hex
+            transcript = synthetic_transcript(self.rng, sentences=self.rng.randint(8, self.args.max_sentences))
+        body = {"session_id": session, "language": "fr", "transcript": transcript, "incremental": True}
+        resp = await self._http("POST", "/scribe", json=body)
+        if resp.status_code == 200:
+            self.sessions.append((session, transcript))
+            del self.sessions[:-1000]
+        return resp
+
+    async def propose(self):
+        note = synthetic_transcript(self.rng, sentences=self.rng.randint(5, 15))
+        return await self._http("POST", "/billing/propose", json={"clinical_note": note, "language": "fr"})
+
+    async def submit(self):
+        session = self.rng.choice(self.sessions)[0] if self.sessions else uuid.uuid4().hex
+        return await self._http("POST", "/billing/submit", json={
+            "session_id": session, "selected_codes": self.rng.choice(_CODES), "confirm": True, "language": "fr",
+            "patient_fhir_ref": "Patient/loadtest", "encounter_fhir_ref": f"Encounter/{uuid.uuid4().hex[:8]}",
+        })
+
+    def _direct_fhir(self) -> Dict[str, Any]:
+        if "fhir" not in self._direct:
+            from app.fhir_client import FHIRClient
+            self._direct["fhir"] = FHIRClient(os.getenv("FHIR_BASE_URL", "http://127.0.0.1:8101"), os.getenv("FHIR_BEARER_TOKEN"))
+        note = synthetic_transcript(self.rng, sentences=5)
+        return self._direct["fhir"].post_resource({
+            "resourceType": "DocumentReference", "status": "current", "type": {"text": "Clinical note - sexual health"},
+            "content": [{"attachment": {"contentType": "text/plain", "data": note.encode("utf-8").hex()}}],
+        })
+
+    def _direct_mado(self) -> Dict[str, Any]:
+        from app.agents.mado_agent import transmit_mado
+        form = {"disease_code": "A54", "disease_label": "Infection gonococcique", "language": "fr",
+                "patient_reference": "Patient/loadtest", "reporter": {"id": "loadtest"},
+                "clinical_summary": synthetic_transcript(self.rng, sentences=4)}
+        res = transmit_mado(form)
+        if res.get("status") != "sent":
+            raise RuntimeError(res.get("details", {}).get("error") or res.get("status"))
+        return res
+
+    async def one(self):
+        scenario = self.pick()
+        started = time.perf_counter()
+        try:
+            if scenario in ("fhir", "mado"):
+                await asyncio.get_running_loop().run_in_executor(None, getattr(self, f"_direct_{scenario}"))
+                status, ok = "ok", True
+            else:
+                resp = await getattr(self, scenario)()
+                status, ok = str(resp.status_code), resp.status_code < 400
+        except httpx.TimeoutException:
+            status, ok = "timeout", False
+        except Exception as e:
+            status, ok = type(e).__name__, False
+        self.recorder.record(scenario, time.perf_counter() - started, status, ok)
+
+    async def closed_loop(self, deadline: float):
+        async def worker():
+            while time.monotonic() < deadline:
+                await self.one()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, deadline: float):
+        # arrivées de Poisson; la concurrence est bornée pour ne pas saturer le poste de test lui-même
+        sem = asyncio.Semaphore(self.args.concurrency * 8)
+        pending = set()
+
+        async def guarded():
+            async with sem:
+                await self.one()
+
+        while time.monotonic() < deadline:
+            task = asyncio.create_task(guarded())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def run(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        deadline = started + self.args.duration
+        try:
+            if self.args.rate:
+                await self.open_loop(deadline)
+            else:
+                await self.closed_loop(deadline)
+        finally:
+            await self.client.aclose()
+        elapsed = time.monotonic() - started
+        report = {"elapsed_s": round(elapsed, 1), "mix": self.mix, "concurrency": self.args.concurrency,
+                  "rate": self.args.rate, "scenarios": self.recorder.report(elapsed)}
+        if self.args.llm_metrics:
+            # état de l'ordonnanceur LLM en fin de tir (files d'attente, limites adaptées après 429)
+            try:
+                async with httpx.AsyncClient(base_url=self.args.base_url, headers=self.client.headers) as c:
+                    report["llm_scheduler"] = (await c.get("/metrics/llm")).json()
+            except Exception as e:
+                report["llm_scheduler"] = {"error": str(e)}
+        return report
+
+def print_report(report: Dict[str, Any]):
+    print(f"durée {report['elapsed_s']} s  concurrence {report['concurrency']}  débit cible {report['rate'] or 'boucle fermée'}")
+    print(f"{'scénario':<12}{'n':>7}{'req/s':>8}{'erreurs':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  statuts")
+    for name, s in report["scenarios"].items():
+        print(f"{name:<12}{s['count']:>7}{s['rps']:>8}{s['error_rate']:>9.2%}{s['p50_ms']:>9}{s['p90_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}  {s['statuses']}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Générateur de charge AuraScribe")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--token", default=os.getenv("LOADTEST_TOKEN"), help="JWT (scope billing.submit pour submit)")
+    parser.add_argument("--mix", default="scribe=6,propose=3,submit=1")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0, help="requêtes/s en boucle ouverte (0 = boucle fermée)")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--audio", nargs="*", default=[], help="fichiers ou motifs glob pour transcribe")
+    parser.add_argument("--max-sentences", type=int, default=60)
+    parser.add_argument("--incremental-share", type=float, default=0.2)
+    parser.add_argument("--llm-metrics", action="store_true", help="joindre GET /metrics/llm au rapport")
+    parser.add_argument("--json", help="écrire le rapport JSON dans ce fichier")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    report = asyncio.run(Driver(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    total = sum(s["count"] for s in report["scenarios"].values())
+    errors = sum(s["count"] * s["error_rate"] for s in report["scenarios"].values())
+    return 1 if total and errors / total > 0.5 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# tools/loadtest_stubs.py
+"""
+Services de remplacement locaux pour les tests de charge (jamais les vrais RAMQ / santé publique / EMR).
+    python tools/loadtest_stubs.py --service ramq:latency=200,jitter=80,errors=0.02,rps=30 \
+                                  --service llm:latency=800,rps=20
+
+Services (port par défaut):
+    fhir  8101  POST /{resourceType}          -> FHIRClient (FHIR_BASE_URL)
+    ramq  8102  POST /claims                  -> RamqClient / worker RQ (RAMQ_API_URL)
+    mado  8103  POST /declarations            -> transmit_mado (MADO_API_URL)
+    llm   8104  POST /v1/chat/completions     -> agents texte (OPENAI_API_BASE), réponse factice
+    smtp  8125  SMTP minimal, sans TLS        -> repli courriel MADO (SMTP_HOST/SMTP_PORT, SMTP_STARTTLS=false)
+
+Comportement par service: latency (ms, moyenne), jitter (ms), errors (taux de 5xx / 451), rps (au-delà: 429 / 421).
+GET /_stats sur chaque service HTTP renvoie les compteurs.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Any, Optional
+from cryptography.fernet import Fernet
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+DEFAULT_PORTS = {"fhir": 8101, "ramq": 8102, "mado": 8103, "llm": 8104, "smtp": 8125}
+
+class Behaviour:
+    def __init__(self, latency: float = 50, jitter: float = 20, errors: float = 0.0, rps: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.rps = rps
+        self._tokens = rps
+        self._last = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0}
+
+    def _allow(self) -> bool:
+        if not self.rps:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rps, self._tokens + (now - self._last) * self.rps)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def apply(self) -> Optional[str]:
+        """Retourne None (succès), "throttled" ou "error" après la latence simulée."""
+        self.stats["requests"] += 1
+        if not self._allow():
+            self.stats["throttled"] += 1
+            return "throttled"
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)) / 1000.0)
+        if random.random() < self.errors:
+            self.stats["errors"] += 1
+            return "error"
+        self.stats["ok"] += 1
+        return None
+
+def _failure(outcome: str) -> JSONResponse:
+    if outcome == "throttled":
+        return JSONResponse({"error": "rate_limited"}, status_code=429, headers={"Retry-After": "1"})
+    return JSONResponse({"error": "stub_failure"}, status_code=503)
+
+def make_http_app(kind: str, behaviour: Behaviour) -> FastAPI:
+    app = FastAPI(title=f"stub-{kind}")
+
+    @app.get("/_stats")
+    async def stats():
+        return behaviour.stats
+
+    if kind == "fhir":
+        @app.post("/{resource_type}")
+        async def create(resource_type: str, request: Request):
+            body = await request.json()
+            outcome = await behaviour.apply()
+            if outcome:
+                return _failure(outcome)
+            return JSONResponse(dict(body, id=uuid.uuid4().hex, meta={"versionId": "1"}), status_code=201)
+    elif kind == "ramq":
+        @app.post("/claims")
+        async def claim(request: Request):
+            body = await request.json()
+            outcome = await behaviour.apply()
+            if outcome:
+                return _failure(outcome)
+            return {"claim_id": body.get("claim_id"), "status": "accepted", "ramq_ref": uuid.uuid4().hex[:12]}
+    elif kind == "mado":
+        @app.post("/declarations")
+        async def declare(request: Request):
+            await request.body()
+            outcome = await behaviour.apply()
+            if outcome:
+                return _failure(outcome)
+            return {"status": "received", "tracking": uuid.uuid4().hex}
+    elif kind == "llm":
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            body = await request.json()
+            outcome = await behaviour.apply()
+            if outcome:
+                if outcome == "throttled":
+                    return JSONResponse({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                                        status_code=429, headers={"Retry-After": "1"})
+                return _failure(outcome)
+            prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+            content = "Réponse simulée (stub de charge)."
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": 8, "total_tokens": prompt_chars // 4 + 8},
+            }
+    return app
+
+class SMTPStub:
+    """Serveur SMTP minimal (EHLO/AUTH/MAIL/RCPT/DATA/QUIT), sans TLS ni stockage des messages."""
+    def __init__(self, behaviour: Behaviour):
+        self.behaviour = behaviour
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def send(line: str):
+            writer.write((line + "\r\n").encode())
+
+        send("220 stub-smtp ESMTP")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                cmd = raw.decode(errors="replace").strip()
+                verb = cmd.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    send("250-stub-smtp")
+                    send("250-AUTH PLAIN LOGIN")
+                    send("250 8BITMIME")
+                elif verb == "HELO":
+                    send("250 stub-smtp")
+                elif verb == "AUTH":
+                    parts = cmd.split()
+                    if len(parts) >= 2 and parts[1].upper() == "LOGIN":
+                        for _ in range(2 - (len(parts) > 2)):
+                            send("334 VXNlcm5hbWU6")
+                            await writer.drain()
+                            await reader.readline()
+                    elif len(parts) == 2:
+                        send("334 ")
+                        await writer.drain()
+                        await reader.readline()
+                    send("235 2.7.0 Authentication successful")
+                elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    send("250 OK")
+                elif verb == "DATA":
+                    send("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    outcome = await self.behaviour.apply()
+                    if outcome == "throttled":
+                        send("421 4.7.0 Too many messages, closing connection")
+                        await writer.drain()
+                        break
+                    send("451 4.3.0 Temporary failure" if outcome else f"250 OK queued as {uuid.uuid4().hex[:10]}")
+                elif verb == "QUIT":
+                    send("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    send("502 Command not implemented")
+                await writer.drain()
+        finally:
+            writer.close()
+
+def parse_service(spec: str):
+    name, _, params = spec.partition(":")
+    opts: Dict[str, Any] = {}
+    for item in filter(None, params.split(",")):
+        key, _, value = item.partition("=")
+        opts[key.strip()] = float(value)
+    port = int(opts.pop("port", DEFAULT_PORTS[name]))
+    return name, port, Behaviour(**opts)
+
+async def serve(services):
+    tasks = []
+    for name, port, behaviour in services:
+        if name == "smtp":
+            server = await asyncio.start_server(SMTPStub(behaviour).handle, "127.0.0.1", port)
+            tasks.append(server.serve_forever())
+        else:
+            config = uvicorn.Config(make_http_app(name, behaviour), host="127.0.0.1", port=port, log_level="warning")
+            tasks.append(uvicorn.Server(config).serve())
+    await asyncio.gather(*tasks)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Services de remplacement pour tests de charge")
+    parser.add_argument("--service", action="append", default=[],
+                        help="nom[:latency=ms,jitter=ms,errors=taux,rps=n,port=p] (répétable; défaut: tous)")
+    args = parser.parse_args(argv)
+    specs = args.service or list(DEFAULT_PORTS)
+    given = {s.partition(":")[0] for s in specs}
+    if args.service:
+        # les services non mentionnés démarrent avec le comportement par défaut
+        specs += [name for name in DEFAULT_PORTS if name not in given]
+    services = [parse_service(s) for s in specs]
+    ports = {name: port for name, port, _ in services}
+    print("Variables d'environnement pour l'API et le worker:")
+    print(f"  FHIR_BASE_URL=http://127.0.0.1:{ports['fhir']}")
+    print(f"  RAMQ_API_URL=http://127.0.0.1:{ports['ramq']}/claims")
+    print(f"  MADO_API_URL=http://127.0.0.1:{ports['mado']}/declarations   (ou vide pour passer par SMTP)")
+    print(f"  OPENAI_API_BASE=http://127.0.0.1:{ports['llm']}/v1  OPENAI_API_KEY=stub")
+    print(f"  SMTP_HOST=127.0.0.1 SMTP_PORT={ports['smtp']} SMTP_STARTTLS=false MADO_EMAIL_TO=sante-publique@example.test")
+    # clés Fernet obligatoires, identiques pour l'API et les workers (générées pour cette session de test)
+    print("  " + " ".join(f"{name}={Fernet.generate_key().decode()}" for name in ("STT_CACHE_KEY", "MADO_OUTBOX_KEY", "TRANSCRIPTION_JOB_KEY")))
+    asyncio.run(serve(services))
+
+if __name__ == "__main__":
+    main()
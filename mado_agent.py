@@ -4,14 +4,15 @@ Agent MADO: gère la démarche de déclaration obligatoire (MADO) pour le Québe
 - Trois étapes:
     1) Vérifier la liste des maladies à déclaration obligatoire (mado_list.json)
     2) Remplir un formulaire structuré (données minimales nécessaires)
-    3) Transmettre la déclaration (POST via API configurable ou email SMTP) 
+    3) Transmettre la déclaration (boîte d'envoi durable mado_outbox, puis POST API ou email SMTP par le worker)
 Notes de conformité:
 - La transmission automatique vers l'autorité de santé n'est effectuée que si:
     - l'utilisateur/acteur a le scope approprié (ex: "mado.report" ou "emr.write")
     - le clinicien confirme explicitement la transmission (UI confirmation)
 - L'agent attend des références FHIR pour patient/encounter (préféré) plutôt que des identifiants bruts.
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
 import os
 import json
 import re
@@ -20,6 +21,8 @@ import smtplib
 from email.message import EmailMessage
 from .base import AgentBase
 from ..audit import write_audit_event
+from ..mado_outbox import enqueue_declaration
+from ..encryption import MissingKeyError
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 MADO_LIST_PATH = os.path.join(BASE_DIR, "mado", "mado_list.json")
@@ -31,6 +34,8 @@ SMTP_HOST = os.getenv("SMTP_HOST")
 SMTP_PORT = int(os.getenv("SMTP_PORT") or 587)
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
+# désactivable uniquement pour un relais local sans TLS (serveur SMTP de test de charge)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1","true","yes")
 
 def load_mado_list() -> List[Dict[str, Any]]:
     try:
@@ -83,35 +88,55 @@ def build_mado_form(payload: Dict[str, Any], candidate: Dict[str, Any], language
     }
     return form
 
+def mado_channel() -> Tuple[str, Optional[str]]:
+    """Canal de transmission configuré et destinataire: ('api', url), ('smtp', courriel) ou ('manual', None)."""
+    if MADO_API_URL:
+        return "api", MADO_API_URL
+    if SMTP_HOST and MADO_EMAIL_TO:
+        return "smtp", MADO_EMAIL_TO
+    return "manual", None
+
+def build_mado_email(forms: List[Dict[str, Any]], to: str) -> EmailMessage:
+    """Un courriel pour une ou plusieurs déclarations destinées à la même adresse."""
+    msg = EmailMessage()
+    if len(forms) == 1:
+        msg["Subject"] = f"Déclaration MADO: {forms[0].get('disease_label','(maladie inconnue)')}"
+    else:
+        msg["Subject"] = f"Déclarations MADO ({len(forms)})"
+    msg["From"] = SMTP_USER or "no-reply@example.com"
+    msg["To"] = to
+    parts = [
+        f"Formulaire MADO (automatique) - langue: {form.get('language')}\n\n{json.dumps(form, ensure_ascii=False, indent=2)}"
+        for form in forms
+    ]
+    msg.set_content("\n\n---\n\n".join(parts))
+    return msg
+
 def transmit_mado(form: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Transmission configurable:
+    Transmission configurable (synchrone, une connexion par appel; le flux normal passe par la boîte d'envoi mado_outbox):
      - Si MADO_API_URL défini: POST JSON à l'API (avec token si fourni)
      - Sinon, si SMTP configuré et MADO_EMAIL_TO présent: envoyer email (clinician -> santé publique)
      - Sinon: renvoyer le payload form pour examen manuel (UI téléchargeable)
     Retour: {'status': 'sent'/'queued'/'manual_review', 'details': {...}}
     """
-    if MADO_API_URL:
+    channel, recipient = mado_channel()
+    if channel == "api":
         headers = {"Content-Type": "application/json"}
         if MADO_API_TOKEN:
             headers["Authorization"] = f"Bearer {MADO_API_TOKEN}"
         try:
-            resp = requests.post(MADO_API_URL, json=form, headers=headers, timeout=10)
+            resp = requests.post(recipient, json=form, headers=headers, timeout=10)
             resp.raise_for_status()
             return {"status": "sent", "details": {"http_status": resp.status_code, "response": resp.text}}
         except Exception as e:
             return {"status": "error", "details": {"error": str(e)}}
-    elif SMTP_HOST and MADO_EMAIL_TO:
+    elif channel == "smtp":
         try:
-            msg = EmailMessage()
-            subject = f"Déclaration MADO: {form.get('disease_label','(maladie inconnue)')}"
-            msg["Subject"] = subject
-            msg["From"] = SMTP_USER or "no-reply@example.com"
-            msg["To"] = MADO_EMAIL_TO
-            body = f"Formulaire MADO (automatique) - langue: {form.get('language')}\n\n{json.dumps(form, ensure_ascii=False, indent=2)}"
-            msg.set_content(body)
+            msg = build_mado_email([form], recipient)
             with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as s:
-                s.starttls()
+                if SMTP_STARTTLS:
+                    s.starttls()
                 if SMTP_USER and SMTP_PASS:
                     s.login(SMTP_USER, SMTP_PASS)
                 s.send_message(msg)
@@ -171,8 +196,20 @@ class MADOAgent(AgentBase):
                 "candidates": candidates
             }
 
-        # Si confirmé: tenter la transmission
-        tx_result = transmit_mado(form)
+        # Si confirmé: déposer dans la boîte d'envoi durable; le worker mado_outbox_worker transmet
+        # (connexion réutilisée, ré-essais) — la requête ne dépend plus de la latence du relais
+        channel, recipient = mado_channel()
+        if channel == "manual":
+            tx_result = {"status": "manual_review", "details": {"form": form}}
+        else:
+            try:
+                # insertion SQL synchrone (et création de la table au premier appel hors API): hors de la boucle
+                tracking_id = await asyncio.get_running_loop().run_in_executor(
+                    None, enqueue_declaration, form, channel, recipient, actor, session_id)
+                tx_result = {"status": "queued", "tracking_id": tracking_id, "details": {"method": channel}}
+            except MissingKeyError:
+                # boîte d'envoi sans clé partagée: le worker ne pourrait pas lire la déclaration
+                tx_result = {"status": "manual_review", "details": {"form": form, "reason": "MADO_OUTBOX_KEY not configured"}}
         # Audit: ne pas stocker PHI dans metadata — n'enregistrer que l'issue
-        write_audit_event("mado_transmit", actor, session_id, tx_result.get("status","unknown"), {"method": tx_result.get("details", {}).get("method", "api_or_manual")})
+        write_audit_event("mado_transmit_requested", actor, session_id, tx_result["status"], {"method": channel, "tracking_id": tx_result.get("tracking_id")})
         return {"mado_step": 3, "transmit_result": tx_result, "form": {"disease_label": form["disease_label"], "patient_reference": bool(form["patient_reference"])}}
\ No newline at end of file
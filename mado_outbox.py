@@ -0,0 +1,207 @@
+# app/mado_outbox.py
+"""
+Boîte d'envoi durable des déclarations MADO confirmées.
+La requête n'écrit qu'une ligne (formulaire chiffré Fernet, MADO_OUTBOX_KEY) et rend un identifiant de suivi;
+l'envoi est fait par app/queues/mado_outbox_worker.py. Réservation par bail: SELECT ... FOR UPDATE SKIP LOCKED,
+puis next_attempt_at repoussé de MADO_OUTBOX_LEASE_S et claimed_by = jeton de la réservation: plusieurs workers
+peuvent tourner, et une ligne d'un worker tombé en cours d'envoi redevient disponible à l'expiration du bail.
+Le bail est renouvelé avant chaque envoi (renew_lease) et toute écriture du worker est conditionnée au jeton:
+un worker qui a perdu son bail n'envoie plus et n'écrase pas l'issue d'un autre.
+Statuts: pending -> sending -> sent | failed (après MADO_OUTBOX_MAX_ATTEMPTS essais: revue manuelle).
+MADO_OUTBOX_KEY est obligatoire et partagée entre l'API et les workers (check_config() au démarrage).
+"""
+import json
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from sqlalchemy import Table, Column, Integer, String, DateTime, LargeBinary, Index, select
+from .audit import engine, metadata
+from .encryption import encrypt_bytes, decrypt_bytes, require_keys
+
+logger = logging.getLogger("mado_outbox")
+
+OUTBOX_KEY_ENV = "MADO_OUTBOX_KEY"
+MAX_ATTEMPTS = int(os.getenv("MADO_OUTBOX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_S = float(os.getenv("MADO_OUTBOX_BACKOFF_BASE_S", "30"))
+BACKOFF_MAX_S = float(os.getenv("MADO_OUTBOX_BACKOFF_MAX_S", "3600"))
+LEASE_S = float(os.getenv("MADO_OUTBOX_LEASE_S", "120"))
+UNREADABLE_RETRY_S = float(os.getenv("MADO_OUTBOX_UNREADABLE_RETRY_S", "600"))
+
+mado_outbox = Table(
+    "mado_outbox",
+    metadata,
+    Column("id", String(32), primary_key=True),           # identifiant de suivi
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+    Column("status", String, nullable=False),
+    Column("channel", String, nullable=False),             # api | smtp
+    Column("recipient", String, nullable=False),           # URL ou adresse de santé publique (pas de PHI)
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("next_attempt_at", DateTime, nullable=False),
+    Column("last_error", String, nullable=True),
+    Column("actor", String, nullable=False),
+    Column("session_id", String, nullable=True),
+    Column("disease_code", String, nullable=True),
+    Column("payload", LargeBinary, nullable=False),        # formulaire chiffré
+    Column("claimed_by", String(32), nullable=True),       # jeton de la réservation en cours (statut sending)
+    Index("ix_mado_outbox_due", "status", "next_attempt_at"),
+)
+
+_table_ready = False
+
+def check_config():
+    """Lève MissingKeyError si MADO_OUTBOX_KEY est absente ou invalide."""
+    require_keys(OUTBOX_KEY_ENV)
+
+def create_table():
+    global _table_ready
+    mado_outbox.create(engine, checkfirst=True)
+    _table_ready = True
+
+def enqueue_declaration(form: Dict[str, Any], channel: str, recipient: str, actor: str, session_id: Optional[str]) -> str:
+    """Lève MissingKeyError sans clé configurée: rien n'est déposé qu'un worker ne pourrait lire."""
+    payload = encrypt_bytes(OUTBOX_KEY_ENV, json.dumps(form, ensure_ascii=False).encode("utf-8"))
+    if not _table_ready:
+        create_table()
+    tracking_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(mado_outbox.insert().values(
+            id=tracking_id,
+            created_at=now,
+            updated_at=now,
+            status="pending",
+            channel=channel,
+            recipient=recipient,
+            attempts=0,
+            next_attempt_at=now,
+            actor=actor,
+            session_id=session_id,
+            disease_code=form.get("disease_code"),
+            payload=payload,
+        ))
+    return tracking_id
+
+def get_status(tracking_id: str) -> Optional[Dict[str, Any]]:
+    cols = [mado_outbox.c[c] for c in ("id", "status", "channel", "attempts", "created_at", "updated_at", "next_attempt_at", "last_error", "actor", "session_id")]
+    with engine.connect() as conn:
+        row = conn.execute(select(*cols).where(mado_outbox.c.id == tracking_id)).mappings().first()
+    if row is None:
+        return None
+    out = dict(row)
+    out["tracking_id"] = out.pop("id")
+    if out["status"] in ("sent", "failed"):
+        out.pop("next_attempt_at")
+    for key in ("created_at", "updated_at", "next_attempt_at"):
+        if out.get(key) is not None:
+            out[key] = out[key].isoformat() + "Z"
+    return out
+
+def claim_due(limit: int) -> List[Dict[str, Any]]:
+    """
+    Réserve jusqu'à `limit` déclarations échues; les formulaires sont déchiffrés pour l'envoi.
+    Chaque élément porte le jeton de réservation (claimed_by) à passer à renew_lease / release / mark_result.
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(mado_outbox)
+            .where(mado_outbox.c.status.in_(("pending", "sending")), mado_outbox.c.next_attempt_at <= now)
+            .order_by(mado_outbox.c.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).mappings().all()
+        if not rows:
+            return []
+        conn.execute(
+            mado_outbox.update()
+            .where(mado_outbox.c.id.in_([r["id"] for r in rows]))
+            .values(status="sending", updated_at=now, next_attempt_at=now + timedelta(seconds=LEASE_S), claimed_by=token)
+        )
+    claimed = []
+    for row in rows:
+        item = dict(row)
+        try:
+            item["form"] = json.loads(decrypt_bytes(OUTBOX_KEY_ENV, bytes(item.pop("payload"))))
+        except Exception as e:
+            # clé du worker différente de celle de l'API (configuration): la déclaration reste en attente,
+            # sans compter d'essai, et redevient lisible une fois la bonne clé déployée
+            logger.error("mado outbox: déclaration %s illisible (%s), vérifier MADO_OUTBOX_KEY", item["id"], type(e).__name__)
+            _defer(item["id"], token, f"undecryptable: {type(e).__name__}", UNREADABLE_RETRY_S)
+            continue
+        item["claimed_by"] = token
+        claimed.append(item)
+    return claimed
+
+def _owned(tracking_ids: List[str], claimed_by: str):
+    """Lignes encore réservées par ce jeton (bail non repris par un autre worker)."""
+    return (mado_outbox.c.id.in_(tracking_ids), mado_outbox.c.status == "sending", mado_outbox.c.claimed_by == claimed_by)
+
+def _defer(tracking_id: str, claimed_by: str, error: str, delay_s: float):
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            mado_outbox.update()
+            .where(*_owned([tracking_id], claimed_by))
+            .values(status="pending", updated_at=now, next_attempt_at=now + timedelta(seconds=delay_s), last_error=error, claimed_by=None)
+        )
+
+def renew_lease(tracking_ids: List[str], claimed_by: str) -> List[str]:
+    """
+    Repousse le bail de LEASE_S avant un envoi; retourne les identifiants encore réservés par ce jeton.
+    Les autres ont été repris par un autre worker après expiration du bail: ne pas les envoyer.
+    """
+    if not tracking_ids:
+        return []
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        renewed = conn.execute(
+            mado_outbox.update()
+            .where(*_owned(tracking_ids, claimed_by))
+            .values(updated_at=now, next_attempt_at=now + timedelta(seconds=LEASE_S))
+        ).rowcount
+        if renewed == len(tracking_ids):
+            return list(tracking_ids)
+        return list(conn.execute(select(mado_outbox.c.id).where(*_owned(tracking_ids, claimed_by))).scalars())
+
+def release(tracking_ids: List[str], claimed_by: str):
+    """Rend des déclarations réservées mais non tentées (arrêt du worker), sans compter d'essai."""
+    if not tracking_ids:
+        return
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            mado_outbox.update()
+            .where(*_owned(tracking_ids, claimed_by))
+            .values(status="pending", updated_at=now, next_attempt_at=now, claimed_by=None)
+        )
+
+def backoff_delay(attempts: int) -> float:
+    return min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** max(0, attempts - 1))) * (0.5 + random.random())
+
+def mark_result(tracking_id: str, claimed_by: str, ok: bool, error: Optional[str], attempts: int,
+                permanent: bool = False) -> Optional[str]:
+    """
+    Enregistre l'issue d'un essai (attempts: essais précédents); retourne le nouveau statut,
+    ou None si la réservation a été reprise entre-temps (l'issue de l'autre worker prévaut).
+    """
+    now = datetime.utcnow()
+    attempts += 1
+    if ok:
+        status, next_at = "sent", now
+    elif permanent or attempts >= MAX_ATTEMPTS:
+        status, next_at = "failed", now
+    else:
+        status, next_at = "pending", now + timedelta(seconds=backoff_delay(attempts))
+    values = {"status": status, "attempts": attempts, "updated_at": now, "next_attempt_at": next_at,
+              "last_error": (error or "")[:500] or None, "claimed_by": None}
+    if status == "sent":
+        # formulaire transmis: plus de raison de le conserver (conservé en cas d'échec pour la revue manuelle)
+        values["payload"] = b""
+    with engine.begin() as conn:
+        updated = conn.execute(mado_outbox.update().where(*_owned([tracking_id], claimed_by)).values(**values)).rowcount
+    return status if updated else None
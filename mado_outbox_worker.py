@@ -0,0 +1,197 @@
+# app/queues/mado_outbox_worker.py
+"""
+Worker d'envoi de la boîte MADO: python -m app.queues.mado_outbox_worker
+- connexion SMTP conservée entre les envois (STARTTLS + login une seule fois, NOOP après inactivité,
+  reconnexion sur déconnexion / 421), requests.Session (keep-alive) pour l'API
+- regroupement optionnel de plusieurs déclarations vers le même destinataire dans un courriel (MADO_OUTBOX_GROUP_MAX)
+- ré-essais avec backoff exponentiel (mado_outbox.mark_result), issue de chaque envoi au journal d'audit
+- bail renouvelé avant chaque envoi (mado_outbox.renew_lease): une déclaration reprise par un autre worker
+  après expiration du bail (relais lent) n'est pas envoyée une seconde fois
+"""
+import logging
+import os
+import signal
+import smtplib
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from ..agents import mado_agent
+from ..agents.mado_agent import build_mado_email
+from ..mado_outbox import check_config, create_table, claim_due, mark_result, release, renew_lease
+from ..audit import write_audit_event
+
+logger = logging.getLogger("mado_outbox_worker")
+
+POLL_INTERVAL_S = float(os.getenv("MADO_OUTBOX_POLL_S", "2"))
+BATCH_SIZE = int(os.getenv("MADO_OUTBOX_BATCH", "50"))
+GROUP_MAX = int(os.getenv("MADO_OUTBOX_GROUP_MAX", "1"))
+SMTP_IDLE_CHECK_S = float(os.getenv("MADO_SMTP_IDLE_CHECK_S", "30"))
+SMTP_MAX_IDLE_S = float(os.getenv("MADO_SMTP_MAX_IDLE_S", "240"))
+
+class SMTPConnection:
+    """Connexion SMTP réutilisée; ouverte à la demande, fermée après SMTP_MAX_IDLE_S sans envoi."""
+    def __init__(self):
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _open(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(mado_agent.SMTP_HOST, mado_agent.SMTP_PORT, timeout=30)
+        if mado_agent.SMTP_STARTTLS:
+            smtp.starttls()
+        if mado_agent.SMTP_USER and mado_agent.SMTP_PASS:
+            smtp.login(mado_agent.SMTP_USER, mado_agent.SMTP_PASS)
+        return smtp
+
+    def _get(self) -> smtplib.SMTP:
+        idle = time.monotonic() - self._last_used
+        if self._smtp is not None and idle > SMTP_IDLE_CHECK_S:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._open()
+        return self._smtp
+
+    def send(self, msg):
+        for attempt in (0, 1):
+            try:
+                self._get().send_message(msg)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+                # connexion fermée ou 421 du relais: une reconnexion; les autres refus laissent la session utilisable (RSET)
+                if isinstance(e, smtplib.SMTPServerDisconnected) or e.smtp_code == 421:
+                    self.close()
+                    if not attempt:
+                        continue
+                raise
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_MAX_IDLE_S:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+class APISession:
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers["Content-Type"] = "application/json"
+        if mado_agent.MADO_API_TOKEN:
+            self.session.headers["Authorization"] = f"Bearer {mado_agent.MADO_API_TOKEN}"
+
+    def send(self, url: str, form: Dict[str, Any]) -> int:
+        resp = self.session.post(url, json=form, timeout=15)
+        resp.raise_for_status()
+        return resp.status_code
+
+def _permanent(error: Exception) -> bool:
+    """Erreurs qu'un ré-essai ne corrigera pas (4xx hors 408/429, refus SMTP 5xx)."""
+    resp = getattr(error, "response", None)
+    if resp is not None and 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+        return True
+    code = getattr(error, "smtp_code", None)
+    return (isinstance(code, int) and code >= 500) or isinstance(error, smtplib.SMTPRecipientsRefused)
+
+class OutboxWorker:
+    def __init__(self):
+        self.smtp = SMTPConnection()
+        self.api = APISession()
+        self.stopping = False
+
+    def _owned(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Renouvelle le bail juste avant l'envoi; ne garde que les déclarations encore réservées par ce worker."""
+        owned = set(renew_lease([i["id"] for i in items], items[0]["claimed_by"]))
+        for item in items:
+            if item["id"] not in owned:
+                logger.warning("mado outbox: bail perdu pour %s, envoi laissé au worker qui l'a repris", item["id"])
+        return [i for i in items if i["id"] in owned]
+
+    def _record(self, item: Dict[str, Any], error: Optional[Exception], method: str, grouped: int = 1):
+        status = mark_result(item["id"], item["claimed_by"], error is None,
+                             None if error is None else f"{type(error).__name__}: {error}",
+                             item["attempts"], permanent=error is not None and _permanent(error))
+        if status is None:
+            # bail expiré pendant l'envoi et repris: l'issue de l'autre worker prévaut
+            logger.warning("mado outbox: bail perdu pendant l'envoi de %s (envoi possiblement doublé)", item["id"])
+            status = "lease_lost"
+        # audit: issue et identifiant de suivi uniquement, jamais le contenu du formulaire
+        write_audit_event("mado_transmit", item["actor"], item["session_id"], status,
+                          {"tracking_id": item["id"], "method": method, "attempt": item["attempts"] + 1, "grouped": grouped})
+
+    def _send_smtp(self, recipient: str, items: List[Dict[str, Any]]):
+        for start in range(0, len(items), max(1, GROUP_MAX)):
+            group = self._owned(items[start:start + max(1, GROUP_MAX)])
+            if not group:
+                continue
+            try:
+                self.smtp.send(build_mado_email([i["form"] for i in group], recipient))
+                error = None
+            except Exception as e:
+                error = e
+            for item in group:
+                self._record(item, error, "smtp", len(group))
+
+    def _send_api(self, recipient: str, items: List[Dict[str, Any]]):
+        for item in items:
+            if not self._owned([item]):
+                continue
+            try:
+                self.api.send(recipient, item["form"])
+                error = None
+            except Exception as e:
+                error = e
+            self._record(item, error, "api")
+
+    def run_once(self) -> int:
+        items = claim_due(BATCH_SIZE)
+        groups = defaultdict(list)
+        for item in items:
+            groups[(item["channel"], item["recipient"])].append(item)
+        for (channel, recipient), group in groups.items():
+            if self.stopping:
+                # arrêt demandé: rendre le reste sans attendre l'expiration du bail
+                release([i["id"] for i in group], group[0]["claimed_by"])
+                continue
+            if channel == "smtp":
+                self._send_smtp(recipient, group)
+            else:
+                self._send_api(recipient, group)
+        return len(items)
+
+    def run_forever(self):
+        # sans la clé partagée avec l'API, aucune déclaration ne serait lisible: arrêt immédiat
+        check_config()
+        create_table()
+        while not self.stopping:
+            try:
+                sent = self.run_once()
+            except Exception:
+                logger.exception("mado outbox: échec du cycle d'envoi")
+                sent = 0
+            if not sent:
+                self.smtp.close_if_idle()
+                time.sleep(POLL_INTERVAL_S)
+        self.smtp.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    worker = OutboxWorker()
+
+    def _stop(*_):
+        worker.stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    worker.run_forever()
@@ -1,13 +1,23 @@
 # app/main.py (extraits modifiés: endpoints billing/propose and /billing/submit)
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .agents.orchestrator import MedicalDirectorAgent
-from .agents.billing_agent import BillingAgent
+from .agents.billing_agent import BillingAgent, SUGGESTIONS_TOP_K, warm_ranker
 from .agents.billing_agent_async import BillingAgentAsync
 from .auth_oauth import verify_token, require_scope
 from .ephemeral_redis import get_session_data, set_session_data, delete_session
 from .fhir_client import FHIRClient
-import os, uuid, aiofiles
+from .audit import write_audit_event
+from .mado_outbox import get_status as mado_outbox_status, check_config as check_mado_outbox_config, create_table as create_mado_outbox_table
+from .agents.mado_agent import mado_channel
+from .stt_cache import new_hasher, HASH_CHUNK_SIZE, check_config as check_stt_cache_config
+from .agents.llm_scheduler import scheduler as llm_scheduler
+from . import profiling
+from . import transcription_jobs
+from .queues.transcription_tasks import transcription_q
+from .agents.stt_batch import probe_duration
+import os, uuid, json, time, asyncio, functools, aiofiles, aiofiles.os
 
 app = FastAPI(title="AuraScribe - Québec (FR default)")
 
@@ -17,6 +27,21 @@ app.add_middleware(
     allow_methods=["POST","GET","OPTIONS"],
     allow_headers=["*"],
 )
+# profilage opt-in (en-tête X-Profile ou bascule admin); sans déclencheur, simple passage
+app.add_middleware(profiling.ProfilingMiddleware)
+
+def upload_limit_middleware(app):
+    """413 sur l'en-tête Content-Length, avant que FastAPI ne lise le corps multipart (tâches de transcription)."""
+    async def middleware(scope, receive, send):
+        if scope["type"] == "http" and scope.get("method") == "POST" and scope.get("path") == "/transcribe/jobs":
+            length = dict(scope.get("headers", ())).get(b"content-length", b"")
+            if length.isdigit() and int(length) > transcription_jobs.MAX_UPLOAD_BYTES:
+                response = JSONResponse({"detail": "upload too large"}, status_code=413)
+                return await response(scope, receive, send)
+        return await app(scope, receive, send)
+    return middleware
+
+app.add_middleware(upload_limit_middleware)
 
 FHIR_BASE = os.getenv("FHIR_BASE_URL")
 FHIR_TOKEN = os.getenv("FHIR_BEARER_TOKEN")
@@ -25,25 +50,162 @@ fhir_client = FHIRClient(FHIR_BASE, FHIR_TOKEN) if FHIR_BASE else None
 orchestrator = MedicalDirectorAgent(fhir_client=fhir_client)
 billing_agent = BillingAgentAsync() if os.getenv("USE_ASYNC_BILLING","true").lower() in ("1","true") else BillingAgent()
 
+@app.on_event("startup")
+async def check_shared_keys():
+    # clés Fernet partagées avec les workers: refus de démarrer plutôt que des données illisibles ailleurs
+    check_stt_cache_config()
+    if mado_channel()[0] != "manual":
+        check_mado_outbox_config()
+        # DDL au démarrage plutôt que pendant la première déclaration
+        await asyncio.get_running_loop().run_in_executor(None, create_mado_outbox_table)
+    transcription_jobs.check_config()
+
+@app.on_event("startup")
+async def build_billing_index():
+    # index BM25 construit avant la première requête plutôt qu'à ses dépens
+    await warm_ranker()
+
+async def _receive_upload(audio: UploadFile, max_bytes: int = None):
+    """Écrit l'envoi dans /tmp en calculant l'empreinte au passage; retourne (chemin, sha256)."""
+    temp_file = f"/tmp/{uuid.uuid4().hex}_{os.path.basename(audio.filename or 'audio')}"
+    # empreinte calculée pendant l'écriture: les ré-essais du client retrouvent le résultat en cache
+    hasher = new_hasher()
+    size = 0
+    async with aiofiles.open(temp_file, "wb") as out:
+        while True:
+            chunk = await audio.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                # envoi sans Content-Length (chunked): limite appliquée à la copie
+                break
+            hasher.update(chunk)
+            await out.write(chunk)
+    if max_bytes is not None and size > max_bytes:
+        await _remove_quietly(temp_file)
+        raise HTTPException(status_code=413, detail="upload too large")
+    return temp_file, hasher.hexdigest()
+
+async def _remove_quietly(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except Exception:
+        pass
+
 @app.post("/transcribe")
 async def transcribe(session: str, language: str = "fr", audio: UploadFile = File(...), anonymous: bool = False, token: dict = Depends(verify_token)):
-    temp_file = f"/tmp/{uuid.uuid4().hex}_{audio.filename}"
-    async with aiofiles.open(temp_file, "wb") as out:
-        content = await audio.read()
-        await out.write(content)
-    payload = {"file_path": temp_file, "language": language, "anonymous": anonymous}
+    temp_file, audio_sha256 = await _receive_upload(audio)
+    payload = {"file_path": temp_file, "language": language, "anonymous": anonymous, "audio_sha256": audio_sha256}
     try:
         res = await orchestrator.run(session, payload, actor=token.get("sub"))
     finally:
-        try:
-            await aiofiles.os.remove(temp_file)
-        except Exception:
-            pass
+        await _remove_quietly(temp_file)
     return res
 
+@app.post("/transcribe/jobs", status_code=202)
+async def transcribe_job_create(session: str, language: str = "fr", audio: UploadFile = File(...), anonymous: bool = False, priority: str = "interactive", token: dict = Depends(verify_token)):
+    actor = token.get("sub")
+    temp_file, audio_sha256 = await _receive_upload(audio, transcription_jobs.MAX_UPLOAD_BYTES)
+    try:
+        # ré-essai client du même envoi: même tâche, pas de double charge (réservé avant l'admission)
+        dedupe = transcription_jobs.dedupe_key(audio_sha256, session, actor)
+        job_id = uuid.uuid4().hex
+        existing = await transcription_jobs.reserve_dedupe(dedupe, job_id)
+        if existing:
+            return JSONResponse(transcription_jobs.public_view(existing), status_code=200)
+        if existing is not None:
+            raise HTTPException(status_code=409, detail="identical upload is already being queued", headers={"Retry-After": "1"})
+        queued = False
+        try:
+            loop = asyncio.get_running_loop()
+            audio_seconds = await loop.run_in_executor(None, probe_duration, temp_file)
+            try:
+                load = await transcription_jobs.admit(job_id, audio_seconds)
+            except transcription_jobs.AdmissionRejected as e:
+                write_audit_event("transcription_job_rejected", actor, session, "rejected", {"reason": e.reason, "audio_seconds": round(audio_seconds, 1)})
+                headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+                raise HTTPException(status_code=e.status_code, detail=e.reason, headers=headers)
+            try:
+                await loop.run_in_executor(None, transcription_jobs.write_spool, job_id, temp_file)
+                job = {
+                    "job_id": job_id,
+                    "status": "queued",
+                    "session_id": session,
+                    "actor": actor,
+                    "audio_sha256": audio_sha256,
+                    "audio_seconds": round(audio_seconds, 1),
+                    "suffix": os.path.splitext(audio.filename or "")[1] or ".wav",
+                    "created_at": time.time(),
+                    "estimated_wait_s": load["estimated_wait_s"],
+                    "payload": {"language": language, "anonymous": anonymous, "audio_sha256": audio_sha256,
+                                "priority": priority if priority in ("interactive", "batch") else "interactive"},
+                }
+                await transcription_jobs.save_job(job)
+                # client Redis synchrone de RQ: hors de la boucle d'événements
+                await loop.run_in_executor(None, functools.partial(
+                    transcription_q.enqueue, "app.queues.transcription_tasks.transcribe_job_task", job_id,
+                    job_id=job_id, job_timeout=transcription_jobs.JOB_TIMEOUT, result_ttl=0))
+            except Exception:
+                await transcription_jobs.release(job_id)
+                transcription_jobs.remove_spool(job_id)
+                raise HTTPException(status_code=503, detail="could not enqueue transcription job")
+            await transcription_jobs.confirm_dedupe(dedupe, job_id)
+            queued = True
+        finally:
+            if not queued:
+                await transcription_jobs.release_dedupe(dedupe, job_id)
+        write_audit_event("transcription_job_queued", actor, session, "queued", {"job_id": job_id, "audio_seconds": round(audio_seconds, 1)})
+    finally:
+        await _remove_quietly(temp_file)
+    return dict(transcription_jobs.public_view(job), status_url=f"/transcribe/jobs/{job_id}", events_url=f"/transcribe/jobs/{job_id}/events")
+
+async def _owned_job(job_id: str, token: dict):
+    job = await transcription_jobs.get_job(job_id)
+    # tâche d'un autre utilisateur: même réponse qu'une tâche inconnue
+    if job is None or job.get("actor") != token.get("sub"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/transcribe/jobs/{job_id}")
+async def transcribe_job_status(job_id: str, token: dict = Depends(verify_token)):
+    job = await _owned_job(job_id, token)
+    out = transcription_jobs.public_view(job)
+    if job["status"] == "done":
+        out["result"] = await transcription_jobs.get_result(job_id)
+        if out["result"] is None:
+            out["status"] = "expired"
+    return out
+
+@app.get("/transcribe/jobs/{job_id}/events")
+async def transcribe_job_events(job_id: str, token: dict = Depends(verify_token)):
+    await _owned_job(job_id, token)
+
+    async def stream():
+        # changements d'état uniquement; le résultat se lit ensuite via GET /transcribe/jobs/{id}
+        last, idle = None, 0.0
+        while True:
+            job = await transcription_jobs.get_job(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"detail\": \"job expired\"}\n\n"
+                return
+            view = transcription_jobs.public_view(job)
+            if view["status"] != last:
+                last, idle = view["status"], 0.0
+                yield f"event: status\ndata: {json.dumps(view)}\n\n"
+            if last in transcription_jobs.TERMINAL:
+                return
+            if idle >= 15:
+                idle = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(1.0)
+            idle += 1.0
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/scribe")
-async def scribe(session_id: str = Body(...), language: str = Body("fr"), transcript: str = Body(...), token: dict = Depends(verify_token)):
-    payload = {"transcript": transcript, "language": language}
+async def scribe(session_id: str = Body(...), language: str = Body("fr"), transcript: str = Body(...), segments: list = Body(None), token_budget: int = Body(None), incremental: bool = Body(False), token: dict = Depends(verify_token)):
+    payload = {"transcript": transcript, "language": language, "segments": segments, "token_budget": token_budget, "incremental": incremental}
     res = await orchestrator.run(session_id, payload, actor=token.get("sub"))
     return res
 
@@ -63,6 +225,16 @@ async def billing_propose(body: dict = Body(...), token: dict = Depends(verify_t
     res = await billing_agent.propose(session_id or "unknown", {"clinical_note": clinical_note, "language": language, "actor": actor})
     return res
 
+@app.post("/billing/propose/batch", dependencies=[Depends(verify_token)])
+async def billing_propose_batch(body: dict = Body(...), token: dict = Depends(verify_token)):
+    notes = body.get("notes")
+    if not notes:
+        raise HTTPException(status_code=400, detail="notes required")
+    top_k = body.get("top_k", SUGGESTIONS_TOP_K)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be a positive integer")
+    return await billing_agent.propose_batch({"notes": notes, "language": body.get("language", "fr"), "top_k": top_k, "actor": token.get("sub")})
+
 @app.post("/billing/submit", dependencies=[Depends(require_scope("billing.submit"))])
 async def billing_submit(body: dict = Body(...), token: dict = Depends(verify_token)):
     session_id = body.get("session_id")
@@ -78,4 +250,41 @@ async def billing_submit(body: dict = Body(...), token: dict = Depends(verify_to
         "actor": token.get("sub")
     }
     res = await billing_agent.submit(session_id, payload)
-    return res
\ No newline at end of file
+    return res
+
+@app.get("/mado/declarations/{tracking_id}", dependencies=[Depends(require_scope("mado.report"))])
+async def mado_declaration_status(tracking_id: str):
+    status = await asyncio.get_running_loop().run_in_executor(None, mado_outbox_status, tracking_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Declaration not found")
+    return status
+
+@app.get("/metrics/llm", dependencies=[Depends(verify_token)])
+async def llm_metrics():
+    return llm_scheduler.metrics()
+
+@app.get("/admin/profiling", dependencies=[Depends(require_scope("admin.profile"))])
+async def profiling_state():
+    return profiling.sampling_state()
+
+@app.post("/admin/profiling", dependencies=[Depends(require_scope("admin.profile"))])
+async def profiling_toggle(body: dict = Body(...), token: dict = Depends(verify_token)):
+    sample_every = body.get("sample_every", 0)
+    if not isinstance(sample_every, int) or sample_every < 0:
+        raise HTTPException(status_code=400, detail="sample_every must be a non-negative integer")
+    state = profiling.set_sampling(sample_every, float(body.get("ttl_s", 600)))
+    write_audit_event("profiling_toggle", token.get("sub"), None, "success", {"sample_every": sample_every, "ttl_s": state["remaining_s"]})
+    return state
+
+@app.get("/admin/profiles", dependencies=[Depends(require_scope("admin.profile"))])
+async def profiles_list():
+    # PROFILING_DIR: lecture de fichiers, hors de la boucle d'événements
+    return {"profiles": await asyncio.get_running_loop().run_in_executor(None, profiling.list_profiles)}
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_scope("admin.profile"))])
+async def profile_get(profile_id: str):
+    collapsed = await asyncio.get_running_loop().run_in_executor(None, profiling.read_profile, profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    # format « collapsed stacks »: flamegraph.pl, speedscope, inferno-flamegraph
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
@@ -13,12 +13,15 @@ from .billing_agent_async import BillingAgentAsync
 from ..ephemeral_redis import set_session_data, delete_session, get_session_data
 from ..fhir_client import FHIRClient
 from ..audit import write_audit_event
+from ..policy_redaction import redact_segments
+from .incremental import incremental_redact, units_state, content_hash
+import json
 import os
 
 class MedicalDirectorAgent(AgentBase):
     def __init__(self, fhir_client: FHIRClient = None):
         stt_backend = os.getenv("STT_BACKEND", "whisper")
-        if stt_backend == "whisper":
+        if stt_backend in ("whisper", "faster-whisper"):
             self.stt = WhisperSTTAgent()
         else:
             self.stt = DeepgramSTTAgent()
@@ -33,6 +36,7 @@ class MedicalDirectorAgent(AgentBase):
         self.fhir = fhir_client
 
     async def run(self, session_id: str, payload: Dict[str, Any], actor: str = "unknown"):
+        segments = payload.get("segments") or []
         if "transcript" in payload and payload["transcript"]:
             transcript = payload["transcript"]
             language = payload.get("language","fr")
@@ -40,25 +44,70 @@ class MedicalDirectorAgent(AgentBase):
             stt_res = await self.stt.run(session_id, payload)
             transcript = stt_res["text"]
             language = stt_res.get("language","fr")
+            segments = stt_res.get("segments", [])
+        # état du passage précédent (unités rédigées, sorties des sections) pour un re-scribe incrémental
+        previous = None
+        if payload.get("incremental"):
+            previous = ((await get_session_data(session_id)) or {}).get("incremental") or {}
         session_obj = {"transcript": transcript, "language": language}
         await set_session_data(session_id, session_obj)
         write_audit_event("transcription_requested", actor, session_id, "success", {"size": len(transcript)})
-        policy = await self.policy.run(session_id, {"transcript": transcript, "language": language})
+        if previous is not None:
+            policy_result, units, incremental_stats = incremental_redact(transcript, previous.get("units", []))
+            policy = {"policy_result": policy_result}
+        else:
+            policy = await self.policy.run(session_id, {"transcript": transcript, "language": language})
+            units = units_state(transcript, policy["policy_result"]["redaction_log"])
+            incremental_stats = None
         redacted_transcript = policy["policy_result"]["redacted_transcript"]
-        tasks = [
-            self.cc.run(session_id, {"transcript": redacted_transcript, "language": language}),
-            self.hpi.run(session_id, {"transcript": redacted_transcript, "language": language}),
-            self.ap.run(session_id, {"transcript": redacted_transcript, "language": language}),
-        ]
-        cc_res, hpi_res, ap_res = await asyncio.gather(*tasks)
+        # segments rédigés un à un (fenêtre de bord pour les données à cheval), frontières et temps
+        # d'origine conservés: unités de découpage du mode transcription longue des agents
+        redacted_segments = redact_segments(segments, language)["segments"] if segments else []
+        # "batch" pour les traitements de fond: l'ordonnanceur LLM sert d'abord l'interactif
+        priority = payload.get("priority", "interactive")
+        section_payload = {"transcript": redacted_transcript, "segments": redacted_segments, "language": language, "priority": priority}
+        for opt in ("token_budget", "chunk_tokens", "overlap_tokens", "max_concurrency"):
+            if payload.get(opt) is not None:
+                section_payload[opt] = payload[opt]
+        # une section n'est ré-extraite que si son entrée rédigée (transcription, segments qui fixent
+        # le découpage) ou ses options ont changé
+        section_hash = content_hash(redacted_transcript, language, json.dumps({k: v for k, v in section_payload.items() if k not in ("transcript", "priority")}, sort_keys=True))
+        prev_sections = (previous or {}).get("sections", {})
+        section_agents = {"chief_complaint": self.cc, "hpi": self.hpi, "assessment_and_plan": self.ap}
+
+        async def run_section(name: str, agent: AgentBase) -> Dict[str, Any]:
+            prev = prev_sections.get(name) or {}
+            if previous is not None and prev.get("h") == section_hash:
+                return {name: prev.get("out", ""), "meta": dict(prev.get("meta") or {}, reused=True), "partials": prev.get("partials", {})}
+            return await agent.run(session_id, dict(section_payload, partials_cache=prev.get("partials", {})))
+
+        cc_res, hpi_res, ap_res = await asyncio.gather(*(run_section(n, a) for n, a in section_agents.items()))
         scribe_input = {
             "chief_complaint": cc_res.get("chief_complaint",""),
             "hpi": hpi_res.get("hpi",""),
             "assessment_and_plan": ap_res.get("assessment_and_plan",""),
-            "language": language
+            "language": language,
+            "priority": priority
+        }
+        scribe_hash = content_hash(scribe_input["chief_complaint"], scribe_input["hpi"], scribe_input["assessment_and_plan"], language)
+        prev_scribe = (previous or {}).get("scribe") or {}
+        if previous is not None and prev_scribe.get("h") == scribe_hash:
+            clinical_note = prev_scribe.get("note", "")
+        else:
+            scribe_res = await self.scribe.run(session_id, scribe_input)
+            clinical_note = scribe_res.get("clinical_note","")
+        if incremental_stats is not None:
+            incremental_stats["sections_reused"] = [n for n, r in zip(section_agents, (cc_res, hpi_res, ap_res)) if (r.get("meta") or {}).get("reused")]
+            incremental_stats["scribe_reused"] = prev_scribe.get("h") == scribe_hash
+        # seules des formes rédigées sont conservées; la transcription brute est retirée plus bas
+        session_obj["incremental"] = {
+            "units": units,
+            "sections": {
+                name: {"h": section_hash, "out": res.get(name, ""), "meta": res.get("meta"), "partials": res.get("partials", {})}
+                for name, res in zip(section_agents, (cc_res, hpi_res, ap_res))
+            },
+            "scribe": {"h": scribe_hash, "note": clinical_note},
         }
-        scribe_res = await self.scribe.run(session_id, scribe_input)
-        clinical_note = scribe_res.get("clinical_note","")
         session_obj.update({"clinical_note": clinical_note})
         await set_session_data(session_id, session_obj)
         mado_res = None
@@ -69,6 +118,7 @@ class MedicalDirectorAgent(AgentBase):
                 "patient_fhir_ref": payload.get("patient_fhir_ref"),
                 "encounter_fhir_ref": payload.get("encounter_fhir_ref"),
                 "reporter": {"id": actor, "display": payload.get("reporter_display","Clinician")},
+                "actor": actor,
                 "mado_confirm": payload.get("mado_confirm", False),
                 "report_notes": payload.get("report_notes", "")
             }
@@ -97,5 +147,11 @@ class MedicalDirectorAgent(AgentBase):
             "policy_result": policy["policy_result"],
             "mado": mado_res,
             "billing_suggestions": billing_res.get("suggestions", []),
-            "fhir_response": fhir_response
+            "fhir_response": fhir_response,
+            "sections_meta": {
+                "chief_complaint": cc_res.get("meta"),
+                "hpi": hpi_res.get("meta"),
+                "assessment_and_plan": ap_res.get("meta"),
+            },
+            "incremental": incremental_stats
         }
\ No newline at end of file
@@ -1,5 +1,5 @@
 import re
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, AsyncIterator
 import uuid
 
 _PATTERNS = {
@@ -9,29 +9,220 @@ _PATTERNS = {
     "date": re.compile(r"\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{4}-\d{2}-\d{2})\b"),
 }
 
-def redact_text(text: str) -> Tuple[str, List[Dict[str, Any]]]:
-    redaction_log = []
-    redacted = text
-    # Process sequentially to preserve offsets - simple approach for MVP
-    offset_delta = 0
-    for category, pattern in _PATTERNS.items():
-        for m in list(pattern.finditer(text)):
-            start, end = m.span()
-            placeholder = f"[REDACTED_{category.upper()}]"
-            token_hash = uuid.uuid5(uuid.NAMESPACE_URL, f"{category}:{m.group(0)}").hex
-            # apply placeholder on redacted string considering previous deltas
-            adj_start = start + offset_delta
-            adj_end = end + offset_delta
-            redacted = redacted[:adj_start] + placeholder + redacted[adj_end:]
-            delta = len(placeholder) - (end - start)
-            offset_delta += delta
-            redaction_log.append({"id": token_hash, "category": category, "start": start, "length": end-start, "placeholder": placeholder})
+def merge_spans(found: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """
+    Plages triées et disjointes: des correspondances qui se chevauchent sont fusionnées;
+    la catégorie retenue est la première de _PATTERNS.
+    """
+    priority = {category: i for i, category in enumerate(_PATTERNS)}
+    spans: List[List[Any]] = []
+    for start, end, category in sorted(found):
+        if spans and start < spans[-1][1]:
+            last = spans[-1]
+            last[1] = max(last[1], end)
+            if priority[category] < priority[last[2]]:
+                last[2] = category
+        else:
+            spans.append([start, end, category])
+    return [tuple(sp) for sp in spans]
+
+def find_pii_spans(text: str) -> List[Tuple[int, int, str]]:
+    """Plages (début, fin, catégorie) à masquer, triées et disjointes."""
+    return merge_spans([
+        (m.start(), m.end(), category)
+        for category, pattern in _PATTERNS.items()
+        for m in pattern.finditer(text)
+        if m.end() > m.start()
+    ])
+
+def _apply_spans(text: str, spans: List[Tuple[int, int, str]], base_offset: int = 0) -> Tuple[str, List[Dict[str, Any]], List[List[int]]]:
+    """Remplace les plages; retourne (texte rédigé, journal, ancres [décalage rédigé, décalage original])."""
+    parts = []
+    log = []
+    anchors = [[0, base_offset]]
+    pos = 0
+    out_len = 0
+    for start, end, category in spans:
+        parts.append(text[pos:start])
+        out_len += start - pos
+        placeholder = f"[REDACTED_{category.upper()}]"
+        token_hash = uuid.uuid5(uuid.NAMESPACE_URL, f"{category}:{text[start:end]}").hex
+        log.append({"id": token_hash, "category": category, "start": base_offset + start, "length": end - start, "placeholder": placeholder})
+        anchors.append([out_len, base_offset + start])
+        parts.append(placeholder)
+        out_len += len(placeholder)
+        pos = end
+        anchors.append([out_len, base_offset + end])
+    parts.append(text[pos:])
+    return "".join(parts), log, anchors
+
+def apply_spans(text: str, spans: List[Tuple[int, int, str]]) -> Tuple[str, List[Dict[str, Any]]]:
+    # une seule passe sur des plages disjointes: les décalages du journal restent ceux du texte original
+    redacted, redaction_log, _ = _apply_spans(text, spans)
     return redacted, redaction_log
 
-def policy_check_and_redact(transcript: str, language: str = "fr") -> Dict[str, Any]:
-    redacted, log = redact_text(transcript)
+def redact_text(text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    return apply_spans(text, find_pii_spans(text))
+
+_MANDATORY_REPORT_KEYWORDS = ["agression sexuelle","viol","abuse","rape","sexual assault","child abuse"]
+
+def detect_flags(transcript: str) -> List[str]:
     flags = []
     lower = transcript.lower()
-    if any(k in lower for k in ["agression sexuelle","viol","abuse","rape","sexual assault","child abuse"]):
+    if any(k in lower for k in _MANDATORY_REPORT_KEYWORDS):
         flags.append("potentielle_declaration_obligatoire")
-    return {"redacted_transcript": redacted, "redaction_log": log, "flags": flags}
\ No newline at end of file
+    return flags
+
+def policy_check_and_redact(transcript: str, language: str = "fr") -> Dict[str, Any]:
+    redacted, log = redact_text(transcript)
+    flags = detect_flags(transcript)
+    return {"redacted_transcript": redacted, "redaction_log": log, "flags": flags}
+
+# Plus longue donnée identifiante attendue (courriel, téléphone avec indicatif...): ce qui est plus
+# proche de la fin du tampon est retenu jusqu'au morceau suivant.
+STREAM_BOUNDARY_WINDOW = 64
+_FLAG_TAIL = max(len(k) for k in _MANDATORY_REPORT_KEYWORDS) - 1
+
+class StreamingRedactor:
+    """
+    Rédaction au fil de l'eau de segments / morceaux de transcription.
+    feed() retient une fenêtre de bord pour qu'un numéro ou un courriel coupé entre deux morceaux soit
+    quand même détecté; chaque morceau émis porte ses décalages originaux, ses temps (interpolés dans
+    les segments d'origine) et des ancres pour ramener une position rédigée au texte original.
+    """
+    def __init__(self, language: str = "fr", window: int = STREAM_BOUNDARY_WINDOW):
+        self.language = language
+        self.window = window
+        self.flags: List[str] = []
+        self.redaction_log: List[Dict[str, Any]] = []
+        self._buffer = ""
+        self._buffer_start = 0
+        self._pieces: List[Tuple[int, int, Any, Any, int]] = []  # (début, fin, t_début, t_fin, index)
+        self._flag_tail = ""
+        self._redacted: List[str] = []
+
+    def feed(self, text: str, start: float = None, end: float = None) -> List[Dict[str, Any]]:
+        orig_start = self._buffer_start + len(self._buffer)
+        self._pieces.append((orig_start, orig_start + len(text), start, end, len(self._pieces)))
+        self._buffer += text
+        # mots-clés de déclaration obligatoire, y compris à cheval sur deux morceaux
+        for flag in detect_flags(self._flag_tail + text):
+            if flag not in self.flags:
+                self.flags.append(flag)
+        self._flag_tail = (self._flag_tail + text)[-_FLAG_TAIL:] if _FLAG_TAIL > 0 else ""
+        return self._emit(final=False)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        return self._emit(final=True)
+
+    def result(self) -> Dict[str, Any]:
+        """Même forme que policy_check_and_redact (après flush)."""
+        return {"redacted_transcript": "".join(self._redacted), "redaction_log": list(self.redaction_log), "flags": list(self.flags)}
+
+    def _time_at(self, offset: int, use_end: bool):
+        for p_start, p_end, t_start, t_end, _ in self._pieces:
+            if p_start <= offset < p_end or (use_end and offset == p_end):
+                if t_start is None or t_end is None:
+                    return t_end if use_end else t_start
+                frac = (offset - p_start) / float(max(p_end - p_start, 1))
+                return t_start + (t_end - t_start) * frac
+        return None
+
+    def _emit(self, final: bool) -> List[Dict[str, Any]]:
+        buf = self._buffer
+        spans = find_pii_spans(buf)
+        cut = len(buf) if final else len(buf) - self.window
+        if cut <= 0:
+            return []
+        if not final:
+            # couper après un espace pour émettre des mots entiers
+            cut = max(buf.rfind(" ", 0, cut), buf.rfind("\n", 0, cut)) + 1
+        for s_start, s_end, _ in spans:
+            if s_start < cut < s_end:
+                cut = s_start  # ne jamais couper une donnée identifiante
+                break
+        if cut <= 0:
+            return []
+        emitted = [sp for sp in spans if sp[1] <= cut]
+        redacted, log, anchors = _apply_spans(buf[:cut], emitted, self._buffer_start)
+        orig_start, orig_end = self._buffer_start, self._buffer_start + cut
+        chunk = {
+            "text": redacted,
+            "orig_start": orig_start,
+            "orig_end": orig_end,
+            "start": self._time_at(orig_start, use_end=False),
+            "end": self._time_at(orig_end, use_end=True),
+            "segments": [p[4] for p in self._pieces if p[0] < orig_end and p[1] > orig_start],
+            "offset_map": anchors,
+            "redaction_log": log,
+            "flags": list(self.flags),
+        }
+        self.redaction_log.extend(log)
+        self._redacted.append(redacted)
+        self._buffer = buf[cut:]
+        self._buffer_start = orig_end
+        # segments entièrement émis: inutiles pour les prochains morceaux
+        self._pieces = [p for p in self._pieces if p[1] > orig_end or p[0] >= orig_end]
+        return [chunk]
+
+def map_to_original(chunk: Dict[str, Any], redacted_offset: int) -> int:
+    """Décalage dans le texte original correspondant à une position du texte rédigé d'un morceau."""
+    anchors = chunk["offset_map"]
+    idx = 0
+    for i, anchor in enumerate(anchors):
+        if anchor[0] > redacted_offset:
+            break
+        idx = i
+    r_off, o_off = anchors[idx]
+    # ancres impaires = début d'un marqueur [REDACTED_*]: on renvoie le début de la donnée masquée
+    return o_off if idx % 2 else o_off + (redacted_offset - r_off)
+
+def split_by_segments(segments: List[Dict[str, Any]], redaction_log: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Texte rédigé découpé selon les segments d'origine (temps conservés): ''.join des textes = transcription rédigée.
+    Une donnée à cheval sur deux segments est remplacée dans celui où elle commence; la suite en est retirée.
+    """
+    spans = sorted((e["start"], e["start"] + e["length"], e["placeholder"]) for e in redaction_log)
+    out = []
+    offset = 0
+    k = 0
+    for seg in segments:
+        text = seg.get("text", "")
+        seg_start, seg_end = offset, offset + len(text)
+        offset = seg_end
+        parts = []
+        pos = seg_start
+        while k < len(spans) and spans[k][0] < seg_end:
+            start, end, placeholder = spans[k]
+            if start >= seg_start:
+                parts.append(text[pos - seg_start:start - seg_start])
+                parts.append(placeholder)
+            pos = max(pos, min(end, seg_end))
+            if end > seg_end:
+                break  # la donnée déborde sur le segment suivant
+            k += 1
+        parts.append(text[pos - seg_start:])
+        out.append({"start": seg.get("start"), "end": seg.get("end"), "text": "".join(parts)})
+    return out
+
+def redact_segments(segments: List[Dict[str, Any]], language: str = "fr") -> Dict[str, Any]:
+    """
+    Rédige des segments Whisper ({text, start, end}); retourne le résultat global, les morceaux émis
+    en flux et les segments rédigés un à un, avec leurs temps d'origine.
+    """
+    redactor = StreamingRedactor(language)
+    chunks = []
+    for seg in segments:
+        chunks.extend(redactor.feed(seg.get("text", ""), seg.get("start"), seg.get("end")))
+    chunks.extend(redactor.flush())
+    result = redactor.result()
+    return dict(result, chunks=chunks, segments=split_by_segments(segments, result["redaction_log"]))
+
+async def redact_stream(segments: AsyncIterator[Dict[str, Any]], language: str = "fr") -> AsyncIterator[Dict[str, Any]]:
+    """Version asynchrone: rédige les segments au fur et à mesure qu'ils sortent du STT."""
+    redactor = StreamingRedactor(language)
+    async for seg in segments:
+        for chunk in redactor.feed(seg.get("text", ""), seg.get("start"), seg.get("end")):
+            yield chunk
+    for chunk in redactor.flush():
+        yield chunk
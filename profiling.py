@@ -0,0 +1,318 @@
+# app/profiling.py
+"""
+Profilage par échantillonnage à la demande, requête par requête (désactivé par défaut).
+Déclenchement:
+    - en-tête X-Profile: <PROFILING_TOKEN> sur une requête (secret partagé, comparé en temps constant)
+    - bascule admin POST /admin/profiling {"sample_every": N, "ttl_s": 600}: une requête sur N est profilée
+Un fil d'échantillonnage lit sys._current_frames() toutes les PROFILING_INTERVAL_MS ms (horloge murale):
+    - boucle d'événements: pile courante si la tâche en cours appartient à la requête profilée
+      (tâches enfants enregistrées par une fabrique de tâches: asyncio.gather de l'orchestrateur, morceaux map-reduce...)
+    - tâches de la requête suspendues: chaîne d'await terminée par "(attente)" (temps passé à attendre LLM, Redis, STT)
+    - fils d'exécution: fonctions soumises via bind_thread() (exécuteur STT)
+Sortie au format « collapsed stacks » (flamegraph.pl, speedscope, inferno). Seuls noms de fonctions et de fichiers
+sont enregistrés, jamais de variables locales. Profils conservés en mémoire par processus (PROFILING_MAX_PROFILES)
+et, si PROFILING_DIR est défini, écrits en <id>.folded + <id>.json (résumé).
+Avec plusieurs workers uvicorn, PROFILING_DIR (partagé) est nécessaire pour que /admin/profiles liste et relise
+les profils de tous les workers: sans lui, seuls ceux du worker qui sert la requête d'administration sont visibles.
+La bascule admin reste propre au worker qui la reçoit (échantillonner avec plusieurs workers: en-tête X-Profile).
+"""
+import asyncio
+import contextvars
+import functools
+import hmac
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import deque, Counter
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_HEADER = b"x-profile"
+INTERVAL_S = float(os.getenv("PROFILING_INTERVAL_MS", "5")) / 1000.0
+MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "120"))
+MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "50"))
+PROFILING_DIR = os.getenv("PROFILING_DIR")
+MAX_DEPTH = 128
+_PROFILE_ID = re.compile(r"[0-9a-f]{16}")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("aurascribe_profile", default=None)
+_active: Dict[str, "Profile"] = {}
+_lock = threading.Lock()
+_profiles: deque = deque(maxlen=MAX_PROFILES)
+_sampler: Optional[threading.Thread] = None
+_sample_every = 0
+_sample_until = 0.0
+_counter = itertools.count(1)
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _frame_stack(frame, stop_code=None) -> List[str]:
+    """Pile externe -> interne; coupée sous le cadre Handle._run de la boucle (ou sous stop_code)."""
+    codes = []
+    while frame is not None and len(codes) < MAX_DEPTH:
+        code = frame.f_code
+        if code is stop_code or (code.co_name == "_run" and code.co_filename.startswith(_ASYNCIO_DIR)):
+            break
+        codes.append(code)
+        frame = frame.f_back
+    return [_label(c) for c in reversed(codes)]
+
+def _await_stack(coro) -> List[str]:
+    """Chaîne d'await d'une coroutine suspendue (cr_await / gi_yieldfrom)."""
+    labels = []
+    while coro is not None and len(labels) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+class Profile:
+    def __init__(self, name: str, trigger: str, loop: asyncio.AbstractEventLoop):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.trigger = trigger
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.started = time.monotonic()
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self.tasks: "weakref.WeakKeyDictionary[asyncio.Task, Tuple[str, ...]]" = weakref.WeakKeyDictionary()
+        self.threads: Dict[int, Tuple[Tuple[str, ...], Any]] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration_ms = None
+        self.status = None
+
+    def sample(self, frames: Dict[int, Any]):
+        if time.monotonic() - self.started > MAX_SECONDS:
+            return
+        running = asyncio.current_task(self.loop)
+        for task, prefix in list(self.tasks.items()):
+            if task.done():
+                continue
+            if task is running:
+                frame = frames.get(self.loop_thread)
+                stack = _frame_stack(frame) if frame is not None else []
+            else:
+                waiter = getattr(task, "_fut_waiter", None)
+                if isinstance(waiter, asyncio.Task) or type(waiter).__name__ == "_GatheringFuture":
+                    continue  # attend des tâches enfants, déjà échantillonnées
+                stack = _await_stack(task.get_coro()) + ["(attente)"]
+            self.stacks[";".join(prefix + tuple(stack))] += 1
+        for tid, (prefix, stop_code) in list(self.threads.items()):
+            frame = frames.get(tid)
+            if frame is not None:
+                self.stacks[";".join(prefix + ("(thread)",) + tuple(_frame_stack(frame, stop_code)))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "samples": self.samples,
+            "interval_ms": INTERVAL_S * 1000,
+            "distinct_stacks": len(self.stacks),
+        }
+
+def _sampler_loop():
+    global _sampler
+    while True:
+        with _lock:
+            profiles = list(_active.values())
+            if not profiles:
+                _sampler = None
+                return
+        frames = sys._current_frames()
+        for profile in profiles:
+            try:
+                profile.sample(frames)
+            except Exception:
+                # course bénigne avec la boucle (tâche terminée, coroutine modifiée): échantillon perdu
+                pass
+        del frames
+        time.sleep(INTERVAL_S)
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sampler_loop, name="profiling-sampler", daemon=True)
+            _sampler.start()
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop):
+    previous = loop.get_task_factory()
+    if getattr(previous, "_aurascribe_profiling", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        if _active:
+            ctx = kwargs.get("context")
+            profile = ctx.get(_current) if ctx is not None else _current.get()
+            if profile is not None and profile.id in _active:
+                parent = profile.tasks.get(asyncio.current_task(loop), ())
+                profile.tasks[task] = parent + tuple(_frame_stack(sys._getframe(1)))
+        return task
+
+    factory._aurascribe_profiling = True
+    loop.set_task_factory(factory)
+
+def start(name: str, trigger: str) -> Profile:
+    loop = asyncio.get_running_loop()
+    _install_task_factory(loop)
+    profile = Profile(name, trigger, loop)
+    profile.tasks[asyncio.current_task()] = ()
+    with _lock:
+        _active[profile.id] = profile
+    _ensure_sampler()
+    return profile
+
+def stop(profile: Profile, status: Optional[int] = None):
+    with _lock:
+        _active.pop(profile.id, None)
+    profile.duration_ms = round((time.monotonic() - profile.started) * 1000, 1)
+    profile.status = status
+    profile.tasks = weakref.WeakKeyDictionary()
+    profile.threads = {}
+    _profiles.append(profile)
+    if PROFILING_DIR:
+        try:
+            os.makedirs(PROFILING_DIR, exist_ok=True)
+            # résumé écrit en dernier: un profil listé par un autre worker est toujours complet
+            _write_atomic(os.path.join(PROFILING_DIR, f"{profile.id}.folded"), profile.collapsed())
+            _write_atomic(os.path.join(PROFILING_DIR, f"{profile.id}.json"), json.dumps(profile.summary()))
+        except OSError:
+            pass
+
+def _write_atomic(path: str, text: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def bind_thread(fn):
+    """
+    Rattache une fonction soumise à un exécuteur au profil de la requête appelante.
+    Hors profilage, renvoie fn telle quelle (aucun coût).
+    """
+    profile = _current.get()
+    if profile is None or profile.id not in _active:
+        return fn
+    loop = profile.loop
+    prefix = profile.tasks.get(asyncio.current_task(loop), ()) + tuple(_frame_stack(sys._getframe(1)))
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        tid = threading.get_ident()
+        profile.threads[tid] = (prefix, bound_code)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.threads.pop(tid, None)
+
+    bound_code = bound.__code__
+    return bound
+
+def set_sampling(sample_every: int, ttl_s: float = 600) -> Dict[str, Any]:
+    global _sample_every, _sample_until
+    _sample_every = max(0, int(sample_every))
+    _sample_until = time.monotonic() + ttl_s if _sample_every else 0.0
+    return sampling_state()
+
+def sampling_state() -> Dict[str, Any]:
+    remaining = max(0.0, _sample_until - time.monotonic()) if _sample_every else 0.0
+    return {
+        "sample_every": _sample_every if remaining else 0,
+        "remaining_s": round(remaining, 1),
+        "header_enabled": bool(PROFILING_TOKEN),
+        "active": len(_active),
+    }
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Profils les plus récents d'abord: ceux de PROFILING_DIR (tous les workers) s'il est défini."""
+    if not PROFILING_DIR:
+        return [p.summary() for p in reversed(_profiles)]
+    try:
+        with os.scandir(PROFILING_DIR) as it:
+            files = [(e.stat().st_mtime, e.path) for e in it if e.name.endswith(".json")]
+    except OSError:
+        return []
+    out = []
+    for _, path in sorted(files, reverse=True)[:MAX_PROFILES]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # supprimé ou illisible entre-temps
+    return out
+
+def read_profile(profile_id: str) -> Optional[str]:
+    """Piles au format collapsed d'un profil terminé (PROFILING_DIR si défini, sinon mémoire du worker)."""
+    if not _PROFILE_ID.fullmatch(profile_id or ""):
+        return None
+    if PROFILING_DIR:
+        try:
+            with open(os.path.join(PROFILING_DIR, f"{profile_id}.folded"), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+    for p in _profiles:
+        if p.id == profile_id:
+            return p.collapsed()
+    return None
+
+def _trigger(scope) -> Optional[str]:
+    if PROFILING_TOKEN:
+        for key, value in scope.get("headers", ()):
+            if key == PROFILE_HEADER:
+                if hmac.compare_digest(value, PROFILING_TOKEN.encode()):
+                    return "header"
+                break
+    if _sample_every and next(_counter) % _sample_every == 0 and time.monotonic() < _sample_until:
+        return "sampled"
+    return None
+
+class ProfilingMiddleware:
+    """Middleware ASGI: profil de la requête entière; id renvoyé dans l'en-tête X-Profile-Id."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/admin/profil"):
+            return await self.app(scope, receive, send)
+        trigger = _trigger(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+        # le chemin seul: les paramètres de requête peuvent contenir des identifiants de session
+        profile = start(f"{scope.get('method')} {scope.get('path')}", trigger)
+        token = _current.set(profile)
+        status = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            stop(profile, status.get("code"))
@@ -1,7 +1,11 @@
 import os
+import asyncio
 from .base import AgentBase
 from typing import Dict, Any
 from deepgram import Deepgram
+from .. import stt_cache
+from ..stt_cache import file_sha256, cache_key, get_or_transcribe
+from ..profiling import bind_thread
 
 DEEPGRAM_KEY = os.getenv("DEEPGRAM_API_KEY")
 
@@ -17,9 +21,15 @@ class DeepgramSTTAgent(AgentBase):
         file_path = payload.get("file_path")
         language = payload.get("language", "fr")
         if self.dg and file_path:
-            with open(file_path, "rb") as f:
-                resp = await self.dg.transcription.pre_recorded({"buffer": f}, {"punctuate": True, "language": language})
-            text = resp["results"]["channels"][0]["alternatives"][0]["transcript"]
-            return {"text": text, "language": language}
+            async def transcribe():
+                with open(file_path, "rb") as f:
+                    resp = await self.dg.transcription.pre_recorded({"buffer": f}, {"punctuate": True, "language": language})
+                text = resp["results"]["channels"][0]["alternatives"][0]["transcript"]
+                return {"text": text, "language": language}
+
+            if not stt_cache.STT_CACHE_ENABLED:
+                return await transcribe()
+            audio_sha256 = payload.get("audio_sha256") or await asyncio.get_event_loop().run_in_executor(None, bind_thread(file_sha256), file_path)
+            return await get_or_transcribe(cache_key(audio_sha256, "deepgram", language), transcribe)
         # Fallback: simple placeholder for dev
         return {"text": "(transcription stub — configurer Deepgram ou Whisper pour la production)", "language": language}
\ No newline at end of file
@@ -0,0 +1,231 @@
+# app/agents/stt_batch.py
+"""
+Transcription par lots (hors ligne) avec WhisperSTTAgent.
+Usage (nuit, enregistrements téléversés):
+    python -m app.agents.stt_batch /chemin/vers/audio -o resultats.jsonl --workers 4
+    python -m app.agents.stt_batch --manifest fichiers.txt -o resultats.jsonl
+
+- Un pool de processus, un modèle Whisper chargé (chaud) par processus.
+- Les fichiers les plus longs sont traités en premier pour équilibrer la charge.
+- Les segments sont écrits en JSONL au fur et à mesure; une ligne {"type": "file"} marque un fichier terminé.
+- Relancer avec le même fichier de sortie saute les fichiers déjà terminés.
+- Un processus tué (OOM, crash natif) n'interrompt pas le lot: le fichier fautif est isolé, noté
+  {"type": "error"} (retenté à la reprise), et le pool est recréé pour les fichiers restants.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Set, Tuple, Callable
+from .stt_whisper import WhisperSTTAgent, warm_model
+from .. import stt_cache
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".oga", ".webm", ".flac", ".mp4")
+# Estimation grossière (~128 kbit/s) quand ni wave ni ffprobe ne peuvent lire la durée
+_FALLBACK_BYTES_PER_SECOND = 16000
+
+_agent = None
+
+def probe_duration(file_path: str) -> float:
+    """Durée audio en secondes (wave pour WAV PCM, sinon ffprobe, sinon estimation par taille)."""
+    if file_path.lower().endswith(".wav"):
+        try:
+            with wave.open(file_path, "rb") as w:
+                return w.getnframes() / float(w.getframerate())
+        except Exception:
+            pass
+    if shutil.which("ffprobe"):
+        try:
+            out = subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", file_path],
+                capture_output=True, text=True, timeout=30,
+            )
+            return float(out.stdout.strip())
+        except Exception:
+            pass
+    try:
+        return os.path.getsize(file_path) / float(_FALLBACK_BYTES_PER_SECOND)
+    except OSError:
+        return 0.0
+
+def collect_files(inputs: List[str], manifest: str = None) -> List[str]:
+    files = []
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as f:
+            files.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    # dédoublonner en conservant l'ordre
+    unique = []
+    seen = set()
+    for p in files:
+        p = os.path.abspath(p)
+        if p not in seen:
+            seen.add(p)
+            unique.append(p)
+    return unique
+
+def load_done(output_path: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # dernière ligne tronquée après une interruption
+                continue
+            if rec.get("type") == "file":
+                done.add(rec.get("file"))
+    return done
+
+def _init_worker(threads: int):
+    global _agent
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        os.environ["WHISPER_CPU_THREADS"] = str(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except Exception:
+            pass
+    # fichiers distincts et boucle asyncio par fichier: le cache Redis n'apporte rien ici
+    stt_cache.STT_CACHE_ENABLED = False
+    warm_model()
+    _agent = WhisperSTTAgent()
+
+def _transcribe_one(file_path: str, language: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        res = asyncio.run(_agent.run(f"batch:{os.path.basename(file_path)}", {"file_path": file_path, "language": language}))
+        return {"file": file_path, "ok": True, "result": res, "elapsed": time.perf_counter() - started}
+    except Exception as e:
+        return {"file": file_path, "ok": False, "error": str(e), "elapsed": time.perf_counter() - started}
+
+def _write_result(out, outcome: Dict[str, Any], duration: float):
+    file_path = outcome["file"]
+    if not outcome["ok"]:
+        out.write(json.dumps({"type": "error", "file": file_path, "error": outcome["error"]}, ensure_ascii=False) + "\n")
+        out.flush()
+        return
+    res = outcome["result"]
+    for seg in res.get("segments", []):
+        out.write(json.dumps({
+            "type": "segment",
+            "file": file_path,
+            "id": seg.get("id"),
+            "start": seg.get("start"),
+            "end": seg.get("end"),
+            "text": seg.get("text", ""),
+        }, ensure_ascii=False) + "\n")
+    out.write(json.dumps({
+        "type": "file",
+        "file": file_path,
+        "duration": duration,
+        "elapsed": outcome["elapsed"],
+        "language": res.get("language"),
+        "confidence": res.get("confidence"),
+        "model_meta": res.get("model_meta", {}),
+        "text": res.get("text", ""),
+    }, ensure_ascii=False) + "\n")
+    out.flush()
+
+def _run_pool(paths: List[str], language: str, workers: int, threads: int,
+              on_outcome: Callable[[Dict[str, Any]], None]) -> Tuple[List[str], List[str]]:
+    """
+    Soumet au plus `workers` fichiers à la fois: si un processus meurt (OOM, crash natif), seuls les
+    fichiers alors en cours sont suspects. Retourne (suspects, fichiers jamais soumis).
+    """
+    todo = list(paths)
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        while todo or in_flight:
+            while todo and len(in_flight) < workers:
+                path = todo.pop(0)
+                in_flight[pool.submit(_transcribe_one, path, language)] = path
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken = []
+            for fut in done:
+                path = in_flight.pop(fut)
+                try:
+                    outcome = fut.result()
+                except BrokenProcessPool:
+                    broken.append(path)
+                    continue
+                on_outcome(outcome)
+            if broken:
+                return broken + list(in_flight.values()), todo
+    return [], []
+
+def run_batch(files: List[str], output_path: str, language: str = "fr", workers: int = 1, threads: int = 0) -> Dict[str, Any]:
+    done = load_done(output_path)
+    pending = [p for p in files if p not in done]
+    durations = {p: probe_duration(p) for p in pending}
+    # Longest-processing-time first: les longs fichiers ne restent pas seuls en fin de lot
+    pending.sort(key=lambda p: durations[p], reverse=True)
+    stats = {"files_total": len(files), "files_skipped": len(files) - len(pending), "files_done": 0, "files_failed": 0, "audio_seconds": 0.0}
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        def record(outcome: Dict[str, Any]):
+            _write_result(out, outcome, durations[outcome["file"]])
+            if outcome["ok"]:
+                stats["files_done"] += 1
+                stats["audio_seconds"] += durations[outcome["file"]]
+            else:
+                stats["files_failed"] += 1
+
+        def crashed(path: str):
+            # ligne "error": le fichier sera retenté à la prochaine reprise
+            record({"file": path, "ok": False, "error": "worker process died (BrokenProcessPool)", "elapsed": 0.0})
+
+        remaining = pending
+        while remaining:
+            suspects, remaining = _run_pool(remaining, language, workers, threads, record)
+            if len(suspects) == 1:
+                crashed(suspects[0])
+                continue
+            # plusieurs fichiers en cours au moment du crash: chacun seul dans un pool neuf pour isoler le fautif
+            for path in suspects:
+                if _run_pool([path], language, 1, threads, record)[0]:
+                    crashed(path)
+    wall = time.perf_counter() - started
+    stats["wall_seconds"] = wall
+    # débit: secondes d'audio transcrites par seconde d'horloge
+    stats["throughput"] = stats["audio_seconds"] / wall if wall > 0 else 0.0
+    return stats
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Transcription Whisper par lots (hors ligne)")
+    parser.add_argument("inputs", nargs="*", help="fichiers audio ou répertoires")
+    parser.add_argument("--manifest", help="fichier texte: un chemin audio par ligne")
+    parser.add_argument("-o", "--output", required=True, help="fichier JSONL de sortie (reprise automatique)")
+    parser.add_argument("--language", default="fr")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads", type=int, default=0, help="threads d'inférence par processus (0 = défaut)")
+    args = parser.parse_args(argv)
+    files = collect_files(args.inputs, args.manifest)
+    if not files:
+        print("Aucun fichier audio trouvé", file=sys.stderr)
+        return 2
+    stats = run_batch(files, args.output, args.language, args.workers, args.threads)
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+    print(f"Débit: {stats['throughput']:.2f} s audio / s ({stats['files_done']} terminés, "
+          f"{stats['files_skipped']} déjà faits, {stats['files_failed']} échecs)", file=sys.stderr)
+    return 1 if stats["files_failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
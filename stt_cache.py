@@ -0,0 +1,161 @@
+# app/stt_cache.py
+"""
+Cache des résultats STT par empreinte du contenu audio.
+- Empreinte SHA-256 calculée en flux pendant le téléversement (voir /transcribe) ou relue depuis le fichier.
+- Clé = empreinte + moteur/modèle + langue; valeur chiffrée (Fernet) dans Redis avec TTL court.
+- Les requêtes concurrentes pour le même audio partagent une seule inférence: futur partagé dans le
+  processus, verrou Redis (SET NX, prolongé tant que l'inférence tourne) entre processus et workers;
+  les autres attendent le résultat en cache. Si le propriétaire est annulé, un des appelants en attente reprend.
+- STT_CACHE_KEY est obligatoire quand le cache est actif (check_config() au démarrage).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, Any, Callable, Awaitable, Optional
+from .ephemeral_redis import redis
+from .encryption import encrypt_bytes, decrypt_bytes, require_keys, InvalidToken
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# aligné sur la rétention des transcriptions (TRANSCRIPT_TTL)
+STT_CACHE_TTL = int(os.getenv("STT_CACHE_TTL", os.getenv("TRANSCRIPT_TTL", "300")))
+STT_CACHE_ENABLED = os.getenv("STT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+_KEY_ENV = "STT_CACHE_KEY"
+LOCK_TTL_S = int(os.getenv("STT_CACHE_LOCK_TTL", "30"))          # prolongé par le propriétaire toutes les TTL/3
+LOCK_WAIT_S = float(os.getenv("STT_CACHE_LOCK_WAIT_S", "900"))   # au-delà: inférence locale
+POLL_S = float(os.getenv("STT_CACHE_POLL_S", "0.5"))
+
+# ne touche au verrou que s'il appartient encore à ce propriétaire
+_EXTEND_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+_RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+_inflight: Dict[str, asyncio.Future] = {}
+
+def check_config():
+    """Au démarrage de l'API et des workers de transcription: clé partagée exigée si le cache est actif."""
+    if STT_CACHE_ENABLED:
+        require_keys(_KEY_ENV)
+
+def new_hasher():
+    return hashlib.sha256()
+
+def file_sha256(file_path: str) -> str:
+    h = new_hasher()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(audio_sha256: str, engine: str, language: str) -> str:
+    return f"aura:stt:{engine}:{language}:{audio_sha256}"
+
+async def get_cached(key: str):
+    try:
+        raw = await redis.get(key)
+        if not raw:
+            return None
+        return json.loads(decrypt_bytes(_KEY_ENV, raw.encode("ascii"), ttl=STT_CACHE_TTL))
+    except (InvalidToken, ValueError):
+        return None
+    except Exception:
+        # Redis indisponible: le cache est une optimisation, jamais une dépendance
+        return None
+
+async def set_cached(key: str, result: Dict[str, Any]):
+    try:
+        token = encrypt_bytes(_KEY_ENV, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        await redis.set(key, token.decode("ascii"), ex=STT_CACHE_TTL)
+    except Exception:
+        pass
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+async def _try_lock(key: str, token: str) -> Optional[bool]:
+    """True: verrou pris; False: inférence en cours ailleurs; None: Redis indisponible."""
+    try:
+        return bool(await redis.set(_lock_key(key), token, nx=True, ex=LOCK_TTL_S))
+    except Exception:
+        return None
+
+async def _keep_lock(key: str, token: str):
+    while True:
+        await asyncio.sleep(LOCK_TTL_S / 3)
+        try:
+            await redis.eval(_EXTEND_LOCK, 1, _lock_key(key), token, LOCK_TTL_S)
+        except Exception:
+            pass
+
+async def _unlock(key: str, token: str):
+    try:
+        await redis.eval(_RELEASE_LOCK, 1, _lock_key(key), token)
+    except Exception:
+        pass
+
+async def _transcribe_once(key: str, transcribe: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Cache, sinon verrou Redis: une seule inférence tous processus confondus; sinon attente du résultat."""
+    cached = await get_cached(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+    loop = asyncio.get_running_loop()
+    token = uuid.uuid4().hex
+    deadline = loop.time() + LOCK_WAIT_S
+    while True:
+        locked = await _try_lock(key, token)
+        if locked is not False:
+            break
+        # même audio en cours dans un autre processus: attendre son résultat; verrou expiré (propriétaire
+        # tombé) ou libéré sans résultat (échec): le prochain tour le reprend
+        await asyncio.sleep(POLL_S)
+        cached = await get_cached(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        if loop.time() > deadline:
+            break
+    keeper = asyncio.create_task(_keep_lock(key, token)) if locked else None
+    try:
+        if locked:
+            # résultat écrit entre la lecture du cache et la prise du verrou
+            cached = await get_cached(key)
+            if cached is not None:
+                return dict(cached, cached=True)
+        result = await transcribe()
+        await set_cached(key, result)
+        return result
+    finally:
+        if keeper is not None:
+            keeper.cancel()
+            await _unlock(key, token)
+
+async def get_or_transcribe(key: str, transcribe: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    if not STT_CACHE_ENABLED:
+        return await transcribe()
+    while True:
+        pending = _inflight.get(key)
+        if pending is None:
+            break
+        # même audio déjà en cours dans ce processus: attendre le résultat partagé
+        try:
+            return dict(await asyncio.shield(pending), cached=True)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise
+            # propriétaire annulé: le premier appelant réveillé reprend l'inférence, les suivants l'attendent
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await _transcribe_once(key, transcribe)
+        fut.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        # marquer l'exception comme récupérée si aucun autre appelant n'attendait
+        fut.exception()
+        raise
+    finally:
+        if _inflight.get(key) is fut:
+            _inflight.pop(key)
@@ -5,8 +5,12 @@ Par défaut: FR. Conçu comme fallback principal pour éviter les coûts d'API e
 """
 import os
 import tempfile
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Tuple
 from .base import AgentBase
+from .. import stt_cache
+from ..stt_cache import file_sha256, cache_key, get_or_transcribe
+from ..profiling import bind_thread
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
@@ -25,24 +29,130 @@ try:
 except Exception:
     WHISPER_AVAILABLE = False
 
-def _run_whisper_in_thread(file_path: str, language: str = "fr") -> Dict[str, Any]:
+try:
+    # CTranslate2 (int8 sur CPU): STT_BACKEND=faster-whisper
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except Exception:
+    FASTER_WHISPER_AVAILABLE = False
+
+try:
+    from .audio_preprocess import preprocess_file, remap_segments
+    PREPROCESS_AVAILABLE = True
+except Exception:
+    PREPROCESS_AVAILABLE = False
+
+# Décodage unique 16 kHz mono + compression des silences avant inférence
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "true").lower() in ("1", "true", "yes")
+STT_TRIM_SILENCE = os.getenv("STT_TRIM_SILENCE", "true").lower() in ("1", "true", "yes")
+
+STT_BACKEND = os.getenv("STT_BACKEND", "whisper")
+# faster-whisper: quantification, fils intra-op (0 = défaut CTranslate2), largeur du faisceau
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+_DEFAULT_MODELS = {"faster-whisper": "small", "whisperx": "medium", "whisper": "small"}
+
+# Un modèle par (moteur, nom) et par processus: le chargement coûte plusieurs secondes
+# et ne doit pas être répété à chaque requête ni à chaque fichier d'un lot.
+_MODELS: Dict[Tuple[str, str], Any] = {}
+_MODELS_LOCK = threading.Lock()
+
+def selected_engine() -> str:
+    """Moteur effectif: faster-whisper si demandé et installé, sinon whisperx, sinon openai-whisper."""
+    if STT_BACKEND == "faster-whisper" and FASTER_WHISPER_AVAILABLE:
+        return "faster-whisper"
     if WHISPERX_AVAILABLE:
-        model_name = os.getenv("WHISPER_MODEL", "medium")
-        device = "cuda" if whisperx.utils.get_torch_device().type == "cuda" else "cpu"
-        model = whisperx.load_model(model_name, device)
-        result = model.transcribe(file_path, language=language, task="transcribe")
-        text = result.get("text", "")
-        segments = result.get("segments", [])
-        return {"text": text, "segments": segments, "language": language, "model_meta": {"engine": "whisperx", "model": model_name}}
-    elif WHISPER_AVAILABLE:
-        model_name = os.getenv("WHISPER_MODEL", "small")
-        model = whisper.load_model(model_name)
-        res = model.transcribe(file_path, language=language)
-        text = res.get("text", "")
-        segments = res.get("segments", [])
-        return {"text": text, "segments": segments, "language": language, "model_meta": {"engine": "whisper", "model": model_name}}
-    else:
+        return "whisperx"
+    if WHISPER_AVAILABLE:
+        return "whisper"
+    return "none"
+
+def model_name_for(engine: str) -> str:
+    return os.getenv("WHISPER_MODEL", _DEFAULT_MODELS.get(engine, "small"))
+
+def _load_model(engine: str, model_name: str):
+    key = (engine, model_name)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            if engine == "faster-whisper":
+                # fils lus au chargement: stt_batch fixe WHISPER_CPU_THREADS par processus avant warm_model()
+                model = WhisperModel(model_name, device="cpu", compute_type=WHISPER_COMPUTE_TYPE,
+                                     cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "0")))
+            elif engine == "whisperx":
+                device = "cuda" if whisperx.utils.get_torch_device().type == "cuda" else "cpu"
+                model = whisperx.load_model(model_name, device)
+            else:
+                model = whisper.load_model(model_name)
+            _MODELS[key] = model
+        return model
+
+def warm_model(engine: str = None) -> Dict[str, Any]:
+    """Charge le modèle configuré à l'avance (ex: initializer d'un pool de processus)."""
+    engine = engine or selected_engine()
+    if engine == "none":
+        return {"engine": "none"}
+    model_name = model_name_for(engine)
+    _load_model(engine, model_name)
+    return {"engine": engine, "model": model_name}
+
+def engine_identity() -> str:
+    """Identifie moteur + modèle + prétraitement (tout ce qui change la sortie pour un même audio)."""
+    engine = selected_engine()
+    if engine == "none":
+        return "none"
+    ident = f"{engine}/{model_name_for(engine)}"
+    if engine == "faster-whisper":
+        ident += f"/{WHISPER_COMPUTE_TYPE}/b{WHISPER_BEAM_SIZE}"
+    if STT_PREPROCESS and PREPROCESS_AVAILABLE:
+        ident += "+trim" if STT_TRIM_SILENCE else "+pp"
+    return ident
+
+def _preprocess(file_path: str):
+    if not (STT_PREPROCESS and PREPROCESS_AVAILABLE):
+        return None
+    try:
+        return preprocess_file(file_path, trim_silence=STT_TRIM_SILENCE)
+    except Exception:
+        # format non décodable localement: le modèle décodera lui-même le fichier
+        return None
+
+def _run_faster_whisper(model, audio, language: str) -> Dict[str, Any]:
+    seg_iter, _info = model.transcribe(audio, language=language, beam_size=WHISPER_BEAM_SIZE)
+    # générateur paresseux: le décodage a lieu pendant l'itération; mêmes clés que openai-whisper
+    segments = [
+        {"id": seg.id, "start": seg.start, "end": seg.end, "text": seg.text,
+         "avg_logprob": seg.avg_logprob, "no_speech_prob": seg.no_speech_prob}
+        for seg in seg_iter
+    ]
+    return {"segments": segments, "text": "".join(seg["text"] for seg in segments)}
+
+def _run_whisper_in_thread(file_path: str, language: str = "fr", engine: str = None) -> Dict[str, Any]:
+    engine = engine or selected_engine()
+    if engine == "none":
         return {"text": "", "segments": [], "language": language, "model_meta": {"engine": "none"}}
+    prep = _preprocess(file_path)
+    audio = prep["audio"] if prep else file_path
+    model_name = model_name_for(engine)
+    model = _load_model(engine, model_name)
+    model_meta = {"engine": engine, "model": model_name}
+    if engine == "faster-whisper":
+        result = _run_faster_whisper(model, audio, language)
+        model_meta.update(compute_type=WHISPER_COMPUTE_TYPE, beam_size=WHISPER_BEAM_SIZE)
+    elif engine == "whisperx":
+        result = model.transcribe(audio, language=language, task="transcribe")
+    else:
+        result = model.transcribe(audio, language=language)
+    segments = result.get("segments", [])
+    # whisperx ne renvoie que des segments; le texte est reconstitué au besoin
+    text = result.get("text") or "".join(seg.get("text", "") for seg in segments)
+    if prep:
+        segments = remap_segments(segments, prep["time_map"])
+        model_meta["preprocess"] = {
+            "original_duration": round(prep["original_duration"], 3),
+            "processed_duration": round(prep["processed_duration"], 3),
+        }
+    return {"text": text, "segments": segments, "language": language, "model_meta": model_meta}
 
 class WhisperSTTAgent(AgentBase):
     async def run(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -57,6 +167,15 @@ class WhisperSTTAgent(AgentBase):
             tmp.flush()
             file_path = tmp.name
         loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, _run_whisper_in_thread, file_path, language)
-        confidence = 0.9 if result["segments"] else 0.6
-        return {"text": result["text"], "segments": result.get("segments", []), "language": result.get("language", language), "confidence": confidence, "model_meta": result.get("model_meta", {})}
\ No newline at end of file
+        engine = engine_identity()
+
+        async def transcribe():
+            result = await loop.run_in_executor(executor, bind_thread(_run_whisper_in_thread), file_path, language)
+            confidence = 0.9 if result["segments"] else 0.6
+            return {"text": result["text"], "segments": result.get("segments", []), "language": result.get("language", language), "confidence": confidence, "model_meta": result.get("model_meta", {})}
+
+        # cache désactivé (dont stt_batch): pas de relecture complète du fichier pour l'empreinte
+        if engine == "none" or not stt_cache.STT_CACHE_ENABLED:
+            return await transcribe()
+        audio_sha256 = payload.get("audio_sha256") or await loop.run_in_executor(None, bind_thread(file_sha256), file_path)
+        return await get_or_transcribe(cache_key(audio_sha256, engine, language), transcribe)
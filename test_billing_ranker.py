@@ -0,0 +1,46 @@
+# tests/test_billing_ranker.py
+import json
+import os
+import pytest
+from app.agents.billing_catalog import CompiledCatalog, compile_catalog
+from app.agents.billing_ranker import BillingRanker, sidecar_path
+
+MAPPING_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "mappings", "ramq_codes.json")
+
+@pytest.fixture(scope="module")
+def entries():
+    with open(MAPPING_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def _top(ranker, note):
+    hits = ranker.rank(note, min_confidence=0.0)
+    assert hits
+    return hits[0]
+
+def test_confidence_follows_score_on_sample_catalog(entries):
+    ranker = BillingRanker(entries)
+    full = _top(ranker, "chlamydia")
+    partial = _top(ranker, "chlamydie")
+    assert full["icd10ca"] == partial["icd10ca"]
+    assert full["score"] > partial["score"]
+    assert full["confidence"] > partial["confidence"]
+    assert len({_top(ranker, e["label"]["fr"])["confidence"] for e in entries} | {partial["confidence"]}) > 1
+
+def test_sidecar_round_trip(entries, tmp_path):
+    catalog_path = str(tmp_path / "catalog.bin")
+    compile_catalog(entries, catalog_path)
+    built = BillingRanker(entries)
+    built.save(sidecar_path(catalog_path), catalog_path)
+    catalog = CompiledCatalog(catalog_path)
+    loaded = BillingRanker.load(sidecar_path(catalog_path), catalog.entry, catalog_path)
+    notes = ["Dépistage: chlamydie et gonorrhée", "syphilis secondaire", "aucun code"]
+    assert loaded.rank_batch(notes, min_confidence=0.0) == built.rank_batch(notes, min_confidence=0.0)
+    assert loaded.platt == built.platt
+
+def test_sidecar_rejected_after_recompile(entries, tmp_path):
+    catalog_path = str(tmp_path / "catalog.bin")
+    compile_catalog(entries, catalog_path)
+    BillingRanker(entries).save(sidecar_path(catalog_path), catalog_path)
+    compile_catalog(entries[:-1], catalog_path)
+    with pytest.raises(ValueError):
+        BillingRanker.load(sidecar_path(catalog_path), CompiledCatalog(catalog_path).entry, catalog_path)
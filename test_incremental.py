@@ -0,0 +1,42 @@
+# tests/test_incremental.py
+from app.agents.incremental import incremental_redact, units_state, split_units
+from app.policy_redaction import redact_text, policy_check_and_redact
+
+def _assert_same_as_full(transcript, prev_units):
+    result, state, stats = incremental_redact(transcript, prev_units)
+    redacted, log = redact_text(transcript)
+    assert result["redacted_transcript"] == redacted
+    assert result["redaction_log"] == log
+    return state, stats
+
+def test_phone_split_across_lines_is_redacted_whole():
+    transcript = "Appelez au 514\n555-1234 svp"
+    assert len(split_units(transcript)) == 2
+    result, _, _ = incremental_redact(transcript, [])
+    assert result["redacted_transcript"] == "Appelez au[REDACTED_PHONE] svp"
+    assert "514" not in result["redacted_transcript"]
+
+def test_edit_next_to_unchanged_unit_rescans_the_boundary():
+    before = "Bonjour.\nAppelez au 514\nMerci. Au revoir."
+    state, _ = _assert_same_as_full(before, [])
+    # seule la ligne suivante change: le numéro se complète à travers la frontière
+    after = "Bonjour.\nAppelez au 514\n555-1234 svp. Au revoir."
+    _assert_same_as_full(after, state)
+
+def test_unchanged_units_are_reused():
+    transcript = " ".join(f"Phrase {i}: appelez le 514 555 {1000 + i}." for i in range(50))
+    state, _ = _assert_same_as_full(transcript, [])
+    edited = transcript.replace("Phrase 25: ", "Phrase 25 corrigée: ")
+    _, stats = _assert_same_as_full(edited, state)
+    assert stats["units_redacted"] < stats["units_total"] // 5
+
+def test_state_from_full_redaction_matches_incremental_state():
+    transcript = "Courriel: jean@exemple.ca\nNé le 12/03/1980. Dossier: 4521"
+    log = policy_check_and_redact(transcript)["redaction_log"]
+    assert units_state(transcript, log) == incremental_redact(transcript, [])[1]
+
+def test_state_keeps_no_transcript_text():
+    transcript = "Appelez au 514\n555-1234 svp"
+    _, state, _ = incremental_redact(transcript, [])
+    assert all(set(unit) == {"h", "n", "s"} for unit in state)
+    assert "555" not in repr(state)
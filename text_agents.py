@@ -1,11 +1,134 @@
 from .base import AgentBase
-from typing import Dict, Any
+from .llm_scheduler import scheduler
+from .incremental import content_hash, split_units as split_sentences
+from typing import Dict, Any, List, Optional, Tuple
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
+import asyncio
 import os
+import time
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-llm = ChatOpenAI(temperature=0.2, model="gpt-4o-mini")  # remplacer selon disponibilité
+# max_retries=0: les 429 et erreurs transitoires sont gérés par l'ordonnanceur (backoff partagé)
+llm = ChatOpenAI(temperature=0.2, model="gpt-4o-mini", max_retries=0)  # remplacer selon disponibilité
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # encodage des modèles gpt-4o
+except Exception:
+    _ENCODING = None
+
+# Mode transcription longue (map-reduce): au-delà du budget, découpage en morceaux qui se chevauchent,
+# extractions concurrentes puis fusion. Budget plus bas = appels plus courts (latence) mais plus d'appels.
+LONG_INPUT_TOKEN_BUDGET = int(os.getenv("LLM_LONG_INPUT_TOKEN_BUDGET", "6000"))
+LONG_INPUT_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", "3000"))
+LONG_INPUT_OVERLAP_TOKENS = int(os.getenv("LLM_CHUNK_OVERLAP_TOKENS", "200"))
+LONG_INPUT_CONCURRENCY = int(os.getenv("LLM_CHUNK_CONCURRENCY", "4"))
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # approximation sans tiktoken (~4 caractères par jeton)
+    return (len(text) + 3) // 4
+
+def _squash(text: str) -> str:
+    return " ".join(text.split())
+
+def split_units(transcript: str, segments: Optional[List[Dict[str, Any]]] = None) -> List[str]:
+    """
+    Unités contiguës de découpage (espaces conservés): segments Whisper s'ils reconstituent la transcription
+    (aux espaces près), sinon phrases/lignes; des segments d'une autre version (transcription corrigée,
+    rédaction différente) feraient extraire un texte autre que celui reçu.
+    """
+    if segments:
+        units = [seg.get("text", "") for seg in segments if seg.get("text", "")]
+        if _squash("".join(units)) == _squash(transcript):
+            return units
+    return split_sentences(transcript)
+
+def _option(payload: Dict[str, Any], name: str, default: int) -> int:
+    # 0 est une valeur valide (overlap_tokens=0: morceaux sans chevauchement)
+    value = payload.get(name)
+    return default if value is None else int(value)
+
+def chunk_units(units: List[str], chunk_tokens: int, overlap_tokens: int) -> List[str]:
+    """Regroupe les unités en morceaux d'environ chunk_tokens; chaque morceau reprend la fin du précédent."""
+    # au plus la moitié d'un morceau: sinon chaque morceau ne ferait avancer que d'une unité
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    chunks = []
+    current: List[Tuple[str, int]] = []
+    size = 0
+    for unit in units:
+        n = count_tokens(unit)
+        if current and size + n > chunk_tokens:
+            chunks.append("".join(u for u, _ in current).strip())
+            carry: List[Tuple[str, int]] = []
+            carried = 0
+            for u, un in reversed(current):
+                if carried >= overlap_tokens:
+                    break
+                carry.insert(0, (u, un))
+                carried += un
+            current, size = carry, carried
+        current.append((unit, n))
+        size += n
+    if current:
+        chunks.append("".join(u for u, _ in current).strip())
+    return chunks
+
+async def _complete(system: str, human: str, priority: str = "interactive") -> str:
+    prompt = [SystemMessage(content=system), HumanMessage(content=human)]
+    resp = await scheduler.agenerate(llm, [prompt], priority=priority)
+    return resp.generations[0][0].message.content.strip()
+
+_MAP_NOTE = {
+    "fr": "Ceci est la partie {i}/{n} d'une longue transcription (les parties se chevauchent). N'extraire que ce qui figure dans cette partie; répondre « aucun » si rien de pertinent.",
+    "en": "This is part {i}/{n} of a long transcript (parts overlap). Only extract what appears in this part; answer \"none\" if nothing relevant.",
+}
+_REDUCE_SYSTEM = {
+    "fr": "Vous fusionnez des extractions partielles d'une même consultation en une seule section, sans doublons ni contradictions, en conservant l'ordre chronologique. Consigne de la section: {instruction}",
+    "en": "You merge partial extractions from a single encounter into one section, without duplicates or contradictions, keeping chronological order. Section instruction: {instruction}",
+}
+
+async def extract_section(system: str, human: str, transcript: str, payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+    """
+    Un appel si la transcription tient dans le budget; sinon map-reduce sur les segments.
+    `human` contient {transcript}. Options du payload: token_budget, chunk_tokens, overlap_tokens, max_concurrency.
+    payload["partials_cache"] (empreinte du morceau -> extraction) évite de ré-extraire les morceaux inchangés;
+    les extractions partielles sont retournées en troisième valeur pour le prochain passage.
+    """
+    language = "en" if payload.get("language") == "en" else "fr"
+    priority = payload.get("priority", "interactive")
+    budget = _option(payload, "token_budget", LONG_INPUT_TOKEN_BUDGET)
+    started = time.perf_counter()
+    input_tokens = count_tokens(transcript)
+    if input_tokens <= budget:
+        text = await _complete(system, human.format(transcript=transcript), priority)
+        return text, {"mode": "single", "input_tokens": input_tokens, "chunks": 1, "llm_calls": 1,
+                      "latency_ms": round((time.perf_counter() - started) * 1000)}, {}
+    chunks = chunk_units(split_units(transcript, payload.get("segments")),
+                         max(1, _option(payload, "chunk_tokens", LONG_INPUT_CHUNK_TOKENS)),
+                         max(0, _option(payload, "overlap_tokens", LONG_INPUT_OVERLAP_TOKENS)))
+    sem = asyncio.Semaphore(max(1, _option(payload, "max_concurrency", LONG_INPUT_CONCURRENCY)))
+    cache = payload.get("partials_cache") or {}
+    keys = [content_hash(system, c) for c in chunks]
+
+    async def run_chunk(i: int, chunk: str) -> str:
+        if keys[i] in cache:
+            return cache[keys[i]]
+        async with sem:
+            note = _MAP_NOTE[language].format(i=i + 1, n=len(chunks))
+            return await _complete(f"{system}\n{note}", human.format(transcript=chunk), priority)
+
+    map_started = time.perf_counter()
+    partials = await asyncio.gather(*(run_chunk(i, c) for i, c in enumerate(chunks)))
+    map_ms = round((time.perf_counter() - map_started) * 1000)
+    merged = "\n\n".join(f"[{i + 1}/{len(partials)}]\n{p}" for i, p in enumerate(partials))
+    text = await _complete(_REDUCE_SYSTEM[language].format(instruction=system), merged, priority)
+    reused = sum(1 for k in keys if k in cache)
+    return text, {"mode": "map_reduce", "input_tokens": input_tokens, "chunks": len(chunks), "chunks_reused": reused,
+                  "llm_calls": len(chunks) - reused + 1, "chunk_tokens": [count_tokens(c) for c in chunks],
+                  "map_latency_ms": map_ms, "latency_ms": round((time.perf_counter() - started) * 1000)}, dict(zip(keys, partials))
 
 class ChiefComplaintAgent(AgentBase):
     async def run(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -14,10 +137,8 @@ class ChiefComplaintAgent(AgentBase):
         sys = "Vous êtes un assistant clinique bilingue (FR/EN). Extraiter la plainte principale en 1-2 phrases."
         if language == "en":
             sys = "You are a bilingual clinical assistant (EN/FR). Extract the chief complaint in 1-2 short sentences."
-        prompt = [SystemMessage(content=sys), HumanMessage(content=f"Transcription:\n{transcript}\n\nRetournez: chief_complaint.")]
-        resp = await llm.agenerate(messages=[prompt])
-        text = resp.generations[0][0].message.content.strip()
-        return {"chief_complaint": text}
+        text, meta, partials = await extract_section(sys, "Transcription:\n{transcript}\n\nRetournez: chief_complaint.", transcript, payload)
+        return {"chief_complaint": text, "meta": meta, "partials": partials}
 
 class HPIAgent(AgentBase):
     async def run(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -28,10 +149,8 @@ class HPIAgent(AgentBase):
         if language == "en":
             sys = ("You are a bilingual clinical assistant. Extract HPI structured into: onset, location, duration, quality, "
                    "severity, modifying factors, associated symptoms. Provide bullet points.")
-        prompt = [SystemMessage(content=sys), HumanMessage(content=f"Transcription:\n{transcript}")]
-        resp = await llm.agenerate(messages=[prompt])
-        text = resp.generations[0][0].message.content.strip()
-        return {"hpi": text}
+        text, meta, partials = await extract_section(sys, "Transcription:\n{transcript}", transcript, payload)
+        return {"hpi": text, "meta": meta, "partials": partials}
 
 class APAgent(AgentBase):
     async def run(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -40,10 +159,8 @@ class APAgent(AgentBase):
         sys = "Vous êtes un assistant clinique bilingue. Résumer l'Assessment & Plan brièvement, adapté à l'EMR."
         if language == "en":
             sys = "You are a bilingual clinical assistant. Summarize Assessment & Plan briefly and clearly for EMR insertion."
-        prompt = [SystemMessage(content=sys), HumanMessage(content=f"Transcription:\n{transcript}")]
-        resp = await llm.agenerate(messages=[prompt])
-        text = resp.generations[0][0].message.content.strip()
-        return {"assessment_and_plan": text}
+        text, meta, partials = await extract_section(sys, "Transcription:\n{transcript}", transcript, payload)
+        return {"assessment_and_plan": text, "meta": meta, "partials": partials}
 
 class MedicalScribeAgent(AgentBase):
     async def run(self, session_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -56,7 +173,5 @@ class MedicalScribeAgent(AgentBase):
         if language == "en":
             sys = ("You are a bilingual medical scribe creating a clinical note for sexual health in Québec. "
                    "Follow documentation best practices and do NOT include patient identifiers.")
-        prompt = [SystemMessage(content=sys), HumanMessage(content=f"Chief complaint:\n{chief}\n\nHPI:\n{hpi}\n\nA&P:\n{ap}\n\nReturn clinical note.")]
-        resp = await llm.agenerate(messages=[prompt])
-        text = resp.generations[0][0].message.content.strip()
+        text = await _complete(sys, f"Chief complaint:\n{chief}\n\nHPI:\n{hpi}\n\nA&P:\n{ap}\n\nReturn clinical note.", payload.get("priority", "interactive"))
         return {"clinical_note": text}
\ No newline at end of file
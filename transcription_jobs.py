@@ -0,0 +1,210 @@
+# app/transcription_jobs.py
+"""
+Mode tâche pour la transcription: POST /transcribe/jobs rend un identifiant immédiatement, le pipeline
+(STT + agents) tourne dans un worker RQ (file TRANSCRIPTION_QUEUE_NAME), le client interroge
+GET /transcribe/jobs/{id} ou s'abonne à /transcribe/jobs/{id}/events (SSE).
+
+Admission: refus rapide (503 + Retry-After) plutôt qu'un effondrement sous la charge, selon
+    - le nombre de tâches en attente ou en cours (TRANSCRIPTION_MAX_QUEUED_JOBS)
+    - la durée audio cumulée en attente ou en cours (TRANSCRIPTION_MAX_QUEUED_AUDIO_S)
+    - la durée d'un enregistrement seul (TRANSCRIPTION_MAX_AUDIO_S, 413)
+Le compte est tenu dans un hash Redis {job_id: "secondes:horodatage"}; les entrées orphelines (worker tué)
+expirent après 2 x TRANSCRIPTION_JOB_TIMEOUT. Deux admissions simultanées peuvent dépasser la limite
+d'au plus un enregistrement chacune.
+
+Un ré-essai du même envoi (même audio, session, acteur) rend la tâche existante: l'empreinte est réservée
+(SET NX) avant l'admission, deux envois simultanés ne créent donc qu'une tâche. L'empreinte expire avec le
+résultat; une tâche échouée ou terminée dont le résultat a expiré est relancée.
+
+L'audio est déposé chiffré (TRANSCRIPTION_JOB_KEY, obligatoire et identique pour l'API et les workers:
+check_config() au démarrage) dans TRANSCRIPTION_SPOOL_DIR, volume partagé avec les workers, par morceaux
+de SPOOL_CHUNK_SIZE (mémoire bornée quelle que soit la taille de l'envoi, TRANSCRIPTION_MAX_UPLOAD_MB);
+le résultat (PHI) est conservé chiffré dans Redis TRANSCRIPTION_RESULT_TTL secondes.
+"""
+import json
+import os
+import struct
+import time
+from typing import Dict, Any, Optional
+from .ephemeral_redis import redis
+from .encryption import encrypt_bytes, decrypt_bytes, require_keys
+
+JOB_KEY_ENV = "TRANSCRIPTION_JOB_KEY"
+QUEUE_NAME = os.getenv("TRANSCRIPTION_QUEUE_NAME", "transcription")
+SPOOL_DIR = os.getenv("TRANSCRIPTION_SPOOL_DIR", "/tmp/aura-jobs")
+MAX_QUEUED_JOBS = int(os.getenv("TRANSCRIPTION_MAX_QUEUED_JOBS", "50"))
+MAX_QUEUED_AUDIO_S = float(os.getenv("TRANSCRIPTION_MAX_QUEUED_AUDIO_S", "14400"))
+MAX_AUDIO_S = float(os.getenv("TRANSCRIPTION_MAX_AUDIO_S", "7200"))
+EST_RTF = float(os.getenv("TRANSCRIPTION_EST_RTF", "0.5"))      # temps de traitement / durée audio
+WORKERS = int(os.getenv("TRANSCRIPTION_WORKERS", "2"))
+JOB_TIMEOUT = int(os.getenv("TRANSCRIPTION_JOB_TIMEOUT", "3600"))
+RESULT_TTL = int(os.getenv("TRANSCRIPTION_RESULT_TTL", "900"))
+DEDUPE_RESERVE_S = int(os.getenv("TRANSCRIPTION_DEDUPE_RESERVE_S", "300"))  # création (sondage, dépôt) en cours
+MAX_UPLOAD_BYTES = int(float(os.getenv("TRANSCRIPTION_MAX_UPLOAD_MB", "1024")) * 1024 * 1024)
+PENDING_KEY = "aura:tjob:pending"
+_DELETE_IF_OWNER = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+EXPIRE_IF_OWNER = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+# dépôt: suite de [longueur u32][jeton Fernet]; chaque jeton chiffre (index u32, dernier u8) + morceau
+SPOOL_CHUNK_SIZE = 1024 * 1024
+_FRAME = struct.Struct("<I")
+_CHUNK_HEADER = struct.Struct("<IB")
+_MAX_TOKEN = 2 * SPOOL_CHUNK_SIZE  # base64 (+1/3) et en-tête Fernet: largement au-dessus d'un jeton valide
+TERMINAL = ("done", "failed")
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: Optional[int] = None):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+def check_config():
+    """Lève MissingKeyError si TRANSCRIPTION_JOB_KEY est absente ou invalide (API et workers de transcription)."""
+    require_keys(JOB_KEY_ENV)
+
+def job_key(job_id: str) -> str:
+    return f"aura:tjob:{job_id}"
+
+def result_key(job_id: str) -> str:
+    return f"aura:tjob:{job_id}:result"
+
+def dedupe_key(audio_sha256: str, session_id: str, actor: str) -> str:
+    return f"aura:tjob:dedupe:{audio_sha256}:{session_id}:{actor}"
+
+async def reserve_dedupe(key: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Réserve l'empreinte de l'envoi pour job_id. Retourne None si la réservation est prise; sinon la tâche
+    existante, ou {} si une requête concurrente est en train de la créer. Une tâche échouée, ou terminée
+    mais dont le résultat a expiré, peut être relancée.
+    """
+    for _ in range(2):
+        if await redis.set(key, job_id, nx=True, ex=DEDUPE_RESERVE_S):
+            return None
+        existing_id = await redis.get(key)
+        if not existing_id:
+            continue  # expirée entre les deux lectures
+        existing = await get_job(existing_id)
+        if existing is None:
+            return {}
+        if existing["status"] != "failed" and (existing["status"] != "done" or await redis.exists(result_key(existing_id))):
+            return existing
+        await redis.eval(_DELETE_IF_OWNER, 1, key, existing_id)
+    return {}
+
+async def confirm_dedupe(key: str, job_id: str):
+    """Tâche en file: l'empreinte la désigne jusqu'à sa fin (puis RESULT_TTL, voir transcription_tasks)."""
+    await redis.set(key, job_id, ex=JOB_TIMEOUT)
+
+async def release_dedupe(key: str, job_id: str):
+    await redis.eval(_DELETE_IF_OWNER, 1, key, job_id)
+
+def spool_path(job_id: str) -> str:
+    return os.path.join(SPOOL_DIR, f"{job_id}.enc")
+
+def write_spool(job_id: str, src_path: str):
+    """Chiffre l'envoi morceau par morceau (jamais entièrement en mémoire)."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    tmp = spool_path(job_id) + ".part"
+    with open(src_path, "rb") as src, open(tmp, "wb") as out:
+        index = 0
+        chunk = src.read(SPOOL_CHUNK_SIZE)
+        while True:
+            following = src.read(SPOOL_CHUNK_SIZE)
+            token = encrypt_bytes(JOB_KEY_ENV, _CHUNK_HEADER.pack(index, not following) + chunk)
+            out.write(_FRAME.pack(len(token)))
+            out.write(token)
+            if not following:
+                break
+            chunk, index = following, index + 1
+    os.replace(tmp, spool_path(job_id))
+
+def read_spool(job_id: str, out):
+    """
+    Déchiffre le dépôt morceau par morceau dans le fichier binaire `out`.
+    Lève InvalidToken (clé différente, morceau altéré) ou ValueError (morceau manquant, réordonné, tronqué).
+    """
+    with open(spool_path(job_id), "rb") as src:
+        index = 0
+        while True:
+            head = src.read(_FRAME.size)
+            if len(head) != _FRAME.size:
+                raise ValueError("transcription spool truncated")
+            length = _FRAME.unpack(head)[0]
+            token = src.read(length) if length <= _MAX_TOKEN else b""
+            if not token or len(token) != length:
+                raise ValueError("transcription spool truncated")
+            plain = decrypt_bytes(JOB_KEY_ENV, token)
+            got, last = _CHUNK_HEADER.unpack_from(plain)
+            if got != index:
+                raise ValueError("transcription spool chunks out of order")
+            out.write(plain[_CHUNK_HEADER.size:])
+            if last:
+                if src.read(1):
+                    raise ValueError("transcription spool has trailing data")
+                return
+            index += 1
+
+def remove_spool(job_id: str):
+    try:
+        os.remove(spool_path(job_id))
+    except OSError:
+        pass
+
+def estimate_wait_s(queued_audio_s: float) -> int:
+    return int(queued_audio_s * EST_RTF / max(1, WORKERS)) + 1
+
+def _parse_pending(raw: Dict[str, str], now: float):
+    live, stale = {}, []
+    for job_id, value in raw.items():
+        seconds, _, ts = value.partition(":")
+        if now - float(ts or 0) > 2 * JOB_TIMEOUT:
+            stale.append(job_id)
+        else:
+            live[job_id] = float(seconds)
+    return live, stale
+
+async def admit(job_id: str, audio_seconds: float) -> Dict[str, Any]:
+    """Réserve la place de la tâche ou lève AdmissionRejected; retourne la charge et l'attente estimée."""
+    if audio_seconds > MAX_AUDIO_S:
+        raise AdmissionRejected(413, f"audio longer than {int(MAX_AUDIO_S)} s")
+    now = time.time()
+    live, stale = _parse_pending(await redis.hgetall(PENDING_KEY), now)
+    if stale:
+        await redis.hdel(PENDING_KEY, *stale)
+    queued_s = sum(live.values())
+    # un enregistrement seul est toujours admis sur une file vide, même au-delà de la limite cumulée
+    if len(live) >= MAX_QUEUED_JOBS or (live and queued_s + audio_seconds > MAX_QUEUED_AUDIO_S):
+        # Retry-After: temps estimé pour écouler assez de travail et repasser sous la limite
+        if len(live) >= MAX_QUEUED_JOBS:
+            backlog_s = queued_s / len(live)
+        else:
+            backlog_s = min(queued_s, queued_s + audio_seconds - MAX_QUEUED_AUDIO_S)
+        raise AdmissionRejected(503, "transcription queue full", retry_after=min(600, estimate_wait_s(backlog_s)))
+    await redis.hset(PENDING_KEY, job_id, f"{audio_seconds}:{now}")
+    return {"queued_jobs": len(live) + 1, "queued_audio_s": round(queued_s + audio_seconds, 1), "estimated_wait_s": estimate_wait_s(queued_s + audio_seconds)}
+
+async def release(job_id: str):
+    await redis.hdel(PENDING_KEY, job_id)
+
+async def save_job(job: Dict[str, Any]):
+    await redis.set(job_key(job["job_id"]), json.dumps(job), ex=JOB_TIMEOUT + RESULT_TTL)
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    raw = await redis.get(job_key(job_id))
+    if not raw:
+        return None
+    job = json.loads(raw)
+    if job["status"] == "running" and time.time() - job.get("started_at", 0) > JOB_TIMEOUT:
+        # worker tué par le délai RQ: l'état n'a pas pu être écrit par la tâche
+        job.update(status="failed", error="timeout")
+    return job
+
+async def get_result(job_id: str) -> Optional[Dict[str, Any]]:
+    raw = await redis.get(result_key(job_id))
+    if not raw:
+        return None
+    return json.loads(decrypt_bytes(JOB_KEY_ENV, raw.encode()))
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """État exposé au client (sans l'acteur ni l'empreinte audio)."""
+    return {k: v for k, v in job.items() if k not in ("actor", "audio_sha256", "payload")}
@@ -0,0 +1,92 @@
+# app/queues/transcription_tasks.py
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Any, Optional
+from redis import Redis
+from rq import Queue
+from ..agents.orchestrator import MedicalDirectorAgent
+from ..fhir_client import FHIRClient
+from ..audit import write_audit_event
+from ..encryption import encrypt_bytes
+from ..transcription_jobs import (
+    QUEUE_NAME, JOB_TIMEOUT, RESULT_TTL, PENDING_KEY, JOB_KEY_ENV, SPOOL_DIR, EXPIRE_IF_OWNER,
+    job_key, result_key, dedupe_key, read_spool, remove_spool,
+)
+
+redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+redis_conn = Redis.from_url(redis_url)
+transcription_q = Queue(QUEUE_NAME, connection=redis_conn, default_timeout=JOB_TIMEOUT)
+
+_orchestrator: Optional[MedicalDirectorAgent] = None
+
+def _get_orchestrator() -> MedicalDirectorAgent:
+    global _orchestrator
+    if _orchestrator is None:
+        fhir_base = os.getenv("FHIR_BASE_URL")
+        _orchestrator = MedicalDirectorAgent(fhir_client=FHIRClient(fhir_base, os.getenv("FHIR_BEARER_TOKEN")) if fhir_base else None)
+    return _orchestrator
+
+def _update(job_id: str, **fields) -> Optional[Dict[str, Any]]:
+    raw = redis_conn.get(job_key(job_id))
+    if not raw:
+        return None
+    job = json.loads(raw)
+    job.update(fields)
+    redis_conn.set(job_key(job_id), json.dumps(job), ex=JOB_TIMEOUT + RESULT_TTL)
+    return job
+
+def cleanup_spool(max_age_s: float = 2 * JOB_TIMEOUT):
+    """Retire les dépôts audio de tâches jamais exécutées (file vidée, worker tué)."""
+    now = time.time()
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > max_age_s:
+                os.remove(path)
+        except OSError:
+            pass
+
+def transcribe_job_task(job_id: str):
+    raw = redis_conn.get(job_key(job_id))
+    if not raw:
+        # état expiré avant exécution: rien à rendre au client
+        remove_spool(job_id)
+        redis_conn.hdel(PENDING_KEY, job_id)
+        return
+    job = json.loads(raw)
+    actor = job.get("actor", "unknown")
+    started = time.time()
+    _update(job_id, status="running", started_at=started, queue_wait_s=round(started - job["created_at"], 2))
+    write_audit_event("transcription_job_started", actor, job["session_id"], "started", {"job_id": job_id, "audio_seconds": job.get("audio_seconds")})
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix=job.get("suffix") or ".wav")
+        with os.fdopen(fd, "wb") as f:
+            read_spool(job_id, f)
+        payload = dict(job.get("payload") or {}, file_path=tmp_path)
+        result = asyncio.run(_get_orchestrator().run(job["session_id"], payload, actor=actor))
+        redis_conn.set(result_key(job_id), encrypt_bytes(JOB_KEY_ENV, json.dumps(result).encode("utf-8")), ex=RESULT_TTL)
+        finished = time.time()
+        _update(job_id, status="done", finished_at=finished, processing_s=round(finished - started, 2))
+        # un ré-essai après expiration du résultat relance la tâche au lieu de rendre une tâche sans résultat
+        redis_conn.eval(EXPIRE_IF_OWNER, 1, dedupe_key(job["audio_sha256"], job["session_id"], actor), job_id, RESULT_TTL)
+        write_audit_event("transcription_job_finished", actor, job["session_id"], "success", {"job_id": job_id, "processing_s": round(finished - started, 2)})
+    except Exception as e:
+        # pas de message d'exception côté client: il peut contenir des extraits du contenu
+        _update(job_id, status="failed", finished_at=time.time(), error=type(e).__name__)
+        write_audit_event("transcription_job_finished", actor, job["session_id"], "failed", {"job_id": job_id, "error": type(e).__name__})
+    finally:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        remove_spool(job_id)
+        redis_conn.hdel(PENDING_KEY, job_id)
@@ -1,4 +1,7 @@
 # app/queues/worker.py
+# Files écoutées: WORKER_QUEUES (ordre = priorité), par défaut la file de facturation seule.
+# Les transcriptions, longues, tournent de préférence sur des workers dédiés:
+#   WORKER_QUEUES=transcription python -m app.queues.worker
 import os
 from rq import Worker, Queue, Connection
 from redis import Redis
@@ -7,7 +10,28 @@ redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 redis_conn = Redis.from_url(redis_url)
 
 if __name__ == "__main__":
+    names = [n.strip() for n in os.getenv("WORKER_QUEUES", os.getenv("BILLING_QUEUE_NAME", "billing")).split(",") if n.strip()]
+    if os.getenv("TRANSCRIPTION_QUEUE_NAME", "transcription") in names:
+        # chargé avant le fork des tâches: chaque tâche hérite des modules (et du modèle STT s'il est préchargé)
+        from .transcription_tasks import cleanup_spool
+        from ..agents.stt_whisper import warm_model
+        from ..agents.billing_agent import get_ranker
+        from ..stt_cache import check_config as check_stt_cache_config
+        from ..transcription_jobs import check_config as check_transcription_config
+        from ..agents.mado_agent import mado_channel
+        from ..mado_outbox import check_config as check_mado_outbox_config, create_table as create_mado_outbox_table
+        # clés partagées avec l'API: sans elles, dépôts audio et résultats seraient illisibles
+        check_transcription_config()
+        check_stt_cache_config()
+        if mado_channel()[0] != "manual":
+            # l'orchestrateur dépose les déclarations MADO confirmées: table créée ici, pas pendant une tâche
+            check_mado_outbox_config()
+            create_mado_outbox_table()
+        cleanup_spool()
+        if os.getenv("STT_WARM_ON_START", "true").lower() in ("1", "true", "yes"):
+            warm_model()
+        # l'orchestrateur classe les codes de facturation à chaque tâche: index chargé une fois, hérité au fork
+        get_ranker()
     with Connection(redis_conn):
-        q = Queue(os.getenv("BILLING_QUEUE_NAME", "billing"))
-        worker = Worker([q])
-        worker.work()
\ No newline at end of file
+        worker = Worker([Queue(n) for n in names])
+        worker.work()